@@ -13,7 +13,7 @@ echo "creating files in /tmp"
 
 for repo in ${REPO_LIST[@]}; do
   echo $repo
-  paclist $repo  | cut -d ' ' -f 1 > /tmp/packages_${repo}_$(hostname).txt
+  paclist $repo  | cut -d ' ' -f 1 > /tmp/packages_${repo}_$(hostname)_$(uname -m).txt
 done
 
 
@@ -12,6 +12,11 @@
 
 import os
 import sys
+import json
+import time
+import socket
+import platform
+import shutil
 import wget
 import urllib
 import progressbar as pb
@@ -21,6 +26,20 @@ import progressbar as pb
 # ------ Definitions -------
 local_mirror = 'ftp://192.168.0.95/'
 
+# Log of the hit/miss events, collected by pacyard from its working directory
+# (copy it there, or let it point directly to a share of the working directory).
+# pacyard skips the events it has already imported, a local log is rotated to
+# <xfer_log>.old  when it exceeds  xfer_log_max_size  bytes.
+# None: no logging
+xfer_log = '/var/log/xferlog_' + socket.gethostname() + '.log'
+xfer_log_max_size = 1024 * 1024
+
+# Upload-directory of the local mirror (a share of the sub-dir  upload  of
+# pacyard's working directory):  packages that had to be downloaded from the
+# original server are copied there, pacyard checks and takes them over.
+# None: no upload
+upload_dir = None
+
 
 
 #------------------------------------------------------------------------------------
@@ -60,6 +79,7 @@ def download_from_mirror(url_mirror, file_name):
 
   :param url_mirror:       original download address as specified by pacman
   :param file_name:        local filename as specified by pacman
+  :return:                 True on success, otherwise False
   """
 
   global bar_msg_prefix
@@ -68,12 +88,14 @@ def download_from_mirror(url_mirror, file_name):
   try:
       bar_msg_prefix = '   '
       wget.download(url_mirror, file_name, bar=pbar)
+      return True
   except urllib.error.HTTPError as err:
       print(f'   HTTP-Error {err.code}')
       if err.code != 404:
         print(f'     {err.read()}')
   except:
       print('   Unexpected error')
+  return False
 #------------------------------------------------------------------------------------
 
 
@@ -88,6 +110,7 @@ def download(url_localmirror, url_mirror, file_name):
   :param url_localmirror:  (presumed) download address of local mirror
   :param url_mirror:       original download address as specified by pacmn
   :param file_name:        local filename as specified by pacman
+  :return:                 source of the file: 'mirror', 'internet' or 'failed'
   """
 
   global bar_msg_prefix
@@ -96,10 +119,71 @@ def download(url_localmirror, url_mirror, file_name):
       try:
           bar_msg_prefix = ' * '
           wget.download(url_localmirror, file_name, bar=pbar)
+          return 'mirror'
       except:
-          download_from_mirror(url_mirror, file_name)
-  else:
-      download_from_mirror(url_mirror, file_name)
+          pass
+
+  if download_from_mirror(url_mirror, file_name):
+      return 'internet'
+  return 'failed'
+#------------------------------------------------------------------------------------
+
+
+
+#------------------------------------------------------------------------------------
+def log_event(repo, file, file_name, source, duration):
+  """
+  Append a hit/miss event of a package download to the xfer-log
+
+  :param repo:             repository of the package
+  :param file:             filename of the package
+  :param file_name:        local filename as specified by pacman
+  :param source:           'mirror', 'internet' or 'failed'
+  :param duration:         duration of the download [s]
+  """
+
+  if xfer_log is None  or  '.pkg.tar.' not in file  or  file.endswith('.sig'):
+      return
+
+  try:
+      size = os.path.getsize(file_name) if source != 'failed' else 0
+      event = { 'time': round(time.time(), 3),
+                'host': socket.gethostname(),
+                'repo': repo,
+                'file': file,
+                'size': size,
+                'source': source,
+                'duration': round(duration, 3) }
+      if os.path.exists(xfer_log)  and  os.path.getsize(xfer_log) > xfer_log_max_size:
+          os.replace(xfer_log, xfer_log + '.old')
+      with open(xfer_log, 'a') as f:
+          f.write(json.dumps(event) + '\n')
+  except:
+      pass
+#------------------------------------------------------------------------------------
+
+
+
+#------------------------------------------------------------------------------------
+def upload(file, file_name):
+  """
+  Copy a package (or its signature) downloaded from the original server
+  to the upload-directory of the local mirror
+  (as  .part  file first, so that pacyard doesn't see incomplete files)
+
+  :param file:             filename of the package
+  :param file_name:        local filename as specified by pacman
+  """
+
+  if upload_dir is None  or  '.pkg.tar.' not in file:
+      return
+
+  try:
+      upload_path = os.path.join(upload_dir, file)
+      shutil.copyfile(file_name, upload_path + '.part')
+      os.rename(upload_path + '.part', upload_path)
+  except:
+      pass
 #------------------------------------------------------------------------------------
 
 
@@ -112,15 +196,20 @@ def main():
   # Carve  repo  and  file-name  from the url, so that this works for the urls
   # of the standard-mirrors and as well for the other mirrors configured in
   # /etc/pacman.conf.
-  url_tmp = url_mirror.replace('/os/', '/').replace('/x86_64/', '/')
+  arch = platform.machine()
+  url_tmp = url_mirror.replace('/os/', '/').replace('/' + arch + '/', '/')
   url_parts  = url_tmp.split('/')
   repo = url_parts[-2]
   file = url_parts[-1]
 
-  url_localmirror = os.path.join(local_mirror, repo, file)
+  url_localmirror = os.path.join(local_mirror, arch, repo, file)
 
   print(file_name)
-  download(url_localmirror, url_mirror, file_name)
+  start = time.time()
+  source = download(url_localmirror, url_mirror, file_name)
+  log_event(repo, file, file_name, source, time.time() - start)
+  if source == 'internet':
+      upload(file, file_name)
 #------------------------------------------------------------------------------------
 
 
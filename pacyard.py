@@ -6,41 +6,179 @@ import os
 import sys
 import glob
 import sqlite3
+import signal
+import shutil
+import threading
+import subprocess
+import base64
 # from six.moves import urllib
 from six.moves import configparser
+from six.moves.urllib.parse import urlparse
+from six.moves import queue
 import tarfile
 import hashlib
 import time
 import requests
 import datetime
-import inspect
+import functools
+import json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# statistics of the current run  (see  add_phase_stats() , add_mirror_stats() )
+# and the  MemoryLimit  checked after every phase  (see  set_memory_limit() )
+run_stats = { 'phases': dict(), 'mirrors': dict(), 'memory_limit': None }
+
+# architecture of the packages listed in  packages_<REPO>_<HOSTNAME>.txt
+# (files without architecture) and of the directories of older versions
+DEFAULT_ARCH = 'x86_64'
+
+# log levels and state of the logging  (see  init_logging() )
+LOG_DEBUG = 10
+LOG_INFO  = 20
+LOG_ERROR = 40
+LOG_LEVEL_NAMES = { LOG_DEBUG: 'debug', LOG_INFO: 'info', LOG_ERROR: 'error' }
+
+log_state = { 'level': LOG_ERROR,       # level of the console output
+              'indent': 1,              # current indentation (see log_indented)
+              'last_len': 0,            # length of the last printed line
+              'last_progress': 0.0,     # time of the last progress line
+              'progress_interval': 0.2, # min. seconds between progress lines
+              'is_tty': False,
+              'json_log': None,         # file object of the JSON-lines run log
+              'json_level': LOG_INFO }
+
+# pid-file of the daemon (in the working directory) and state of the daemon
+# mode  (see  run_daemon() )
+PID_FILE = 'pacyard.pid'
+daemon_state = { 'sync_requested': False,   # set by SIGUSR1  (pacyard.py --sync)
+                 'stop': False,             # set by SIGTERM / SIGINT
+                 'session': None,           # HTTP session (kept alive) for polling
+                                            # lastupdate  and the downloads
+                 'poll_health': dict() }    # url -> (failures, skipped until)
+                                            # of the  lastupdate  polls
+
+# layout of the working directory  (see  publish_snapshot() ):
+#   pool/<arch>/<repo>/       package-files, written by the runs only
+#   snapshots/<id>/<arch>/    published state, hardlinks into the pool
+#   current                   symlink to the latest snapshot
+#   <arch>                    symlink to  current/<arch> , read by the clients
+POOL_DIR = 'pool'
+SNAPSHOT_DIR = 'snapshots'
+CURRENT_LINK = 'current'
 
+# -----------------------------------------------------------------------------------
+def init_logging(level, json_log_path=None):
+    """
+    set the level of the console output and open the (optional)
+    JSON-lines run log
+
+    :param  level:          LOG_ERROR, LOG_INFO (-v) or LOG_DEBUG (-vv)
+    :param  json_log_path:  path of the JSON-lines run log (or None)
+    """
 
+    log_state['level'] = level
+    log_state['is_tty'] = sys.stdout.isatty()
+    log_state['json_level'] = min(level, LOG_INFO)
+
+    if json_log_path:
+        try:
+            log_state['json_log'] = open(json_log_path, 'a')
+        except:
+            log('Error: Can\'t open run log ' + json_log_path)
 # -----------------------------------------------------------------------------------
-def debug_print(txt, end='\n'):
+
+# -----------------------------------------------------------------------------------
+def close_logging():
+    """
+    close the JSON-lines run log
     """
-    Print  txt  in case the globale variable  verbose  is True
-    or if this is an error message
 
-    :param  txt:   text to print
+    if log_state['json_log'] is not None:
+        log_state['json_log'].close()
+        log_state['json_log'] = None
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def log_indented(func):
+    """
+    decorator:  indent the log messages of  func
+                (and of the functions called by it) by one more space
     """
 
-    global verbose
-    if not verbose  and  not txt.startswith('Error'):
-        return
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        log_state['indent'] += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            log_state['indent'] -= 1
+    return wrapper
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def log(txt, level=LOG_ERROR, progress=False):
+    """
+    print  txt  if  level  reaches the level of the console output
+    and write it to the JSON-lines run log
 
-    if not hasattr(debug_print, "last_len"):
-        debug_print.last_len = 0
+    progress lines (overwritten by the next line) are printed only
+    on a TTY and at most every  progress_interval  seconds,
+    with  -vv  they are printed as normal lines and written to the run log
 
-    space = ' ' * (len(inspect.stack(0)) - 1)
-    txt = space + txt
+    :param  txt:       text to print
+    :param  level:     LOG_ERROR, LOG_INFO or LOG_DEBUG
+    :param  progress:  True for a progress line
+    """
+
+    json_log = log_state['json_log']
+    if json_log is not None  and  level >= log_state['json_level']  and \
+       (not progress  or  log_state['json_level'] <= LOG_DEBUG):
+        json_log.write(json.dumps({ 'time': round(time.time(), 3),
+                                    'level': LOG_LEVEL_NAMES[level],
+                                    'indent': log_state['indent'],
+                                    'msg': txt.strip() }) + '\n')
+
+    if level < log_state['level']:
+        return
 
-    delta_len = max(0, debug_print.last_len - len(txt))
-    debug_print.last_len = len(txt)
+    end = '\n'
+    if progress  and  log_state['level'] > LOG_DEBUG:
+        if not log_state['is_tty']:
+            return
+        now = time.time()
+        if now - log_state['last_progress'] < log_state['progress_interval']:
+            return
+        log_state['last_progress'] = now
+        end = '\r'
+
+    txt = ' ' * log_state['indent'] + txt
+    delta_len = max(0, log_state['last_len'] - len(txt))
+    log_state['last_len'] = len(txt)
     print(txt + ' ' * delta_len, end=end)
     sys.stdout.flush()
 # -----------------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------------
+def debug_print(txt, end='\n'):
+    """
+    Print  txt  in case of verbose output ( -v )
+    or if this is an error message
+    ( lines ending with  '\\r'  are progress lines, see  log() )
+
+    :param  txt:   text to print
+    :param  end:   '\\n' or '\\r'
+    """
+
+    if txt.startswith('Error'):
+        log(txt, LOG_ERROR)
+    else:
+        log(txt, LOG_INFO, progress=(end == '\r'))
+# -----------------------------------------------------------------------------------
+
 # -----------------------------------------------------------------------------------
 def try_unlink(file_path):
     """
@@ -55,6 +193,223 @@ def try_unlink(file_path):
         pass
 # -----------------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------------
+def hash_file(file_path, algorithm='sha256'):
+    """
+    calculate the hash of a file (read in chunks, so that big files
+    don't have to fit into memory)
+
+    :param  file_path:   path of the file
+    :param  algorithm:   name of the hash algorithm ('md5', 'sha256', ...)
+    :return:             hex digest
+    """
+
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_peak_memory():
+    """
+    peak resident set size of the process
+
+    :return:   peak RSS [kB], or None if unknown (i.e. on Windows)
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB on Linux
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_current_memory():
+    """
+    current resident set size of the process
+
+    :return:   RSS [kB], or None if unknown (no  /proc )
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def set_memory_limit(sqliteConnection, config):
+    """
+    low-memory mode, if  MemoryLimit  is configured:
+    a smaller page cache of SQLite, one worker thread only (see
+    read_config() ), and the run is aborted as soon as the memory exceeds
+    the limit after one of its phases (see  check_memory_limit() )
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  config:              dict with the parsed content of the config-file
+    """
+
+    run_stats['memory_limit'] = config['memory_limit']
+    # (in kB, the default of SQLite is 2000 kB)
+    cache_size = 512 if config['memory_limit'] else 2000
+    sqliteConnection.execute('PRAGMA cache_size=-' + str(cache_size))
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def check_memory_limit(phase):
+    """
+    abort the run, if the memory (RSS) exceeds  MemoryLimit
+    (called after every phase, see  add_phase_stats() )
+
+    :param  phase:       name of the finished phase
+    """
+
+    limit = run_stats['memory_limit']
+    if not limit:
+        return
+    current = get_current_memory()
+    if current is not None  and  current * 1024 > limit:
+        debug_print('Error: memory ' + str(current) + ' kB exceeds '  +
+                    'MemoryLimit after phase ' + phase + ', aborting the run')
+        sys.exit(1)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def add_phase_stats(phase, start_time, count=0):
+    """
+    add the wall time since  start_time  and  count
+    to the statistics of a phase of the current run
+
+    :param  phase:       name of the phase (cleanup, config, db_probe, ...)
+    :param  start_time:  start time of the phase  (time.time())
+    :param  count:       number of processed items (DB-files, packages, ...)
+    """
+
+    phase_stats = run_stats['phases'].setdefault(phase, [0.0, 0])
+    phase_stats[0] += time.time() - start_time
+    phase_stats[1] += count
+    check_memory_limit(phase)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def mirror_host(url):
+    """
+    host of a mirror url  (used as key for the statistics and the health
+    of a mirror, since a flaky server is flaky for all of its repos)
+
+    :param  url:   url of the mirror or of a file on the mirror
+    :return:       host (with port) of the url
+    """
+
+    return urlparse(url).netloc or url
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def add_mirror_stats(url, num_bytes, start_time, error=False):
+    """
+    add a request to the statistics of the mirror (host of the url)
+    of the current run
+
+    :param  url:         requested url
+    :param  num_bytes:   number of transferred bytes
+    :param  start_time:  start time of the request  (time.time())
+    :param  error:       True, if the request failed
+    """
+
+    mirror_stats = run_stats['mirrors'].setdefault(mirror_host(url),
+                                                   [0, 0, 0, 0.0])
+    mirror_stats[0] += num_bytes
+    mirror_stats[1] += 1
+    mirror_stats[2] += 1 if error else 0
+    mirror_stats[3] += time.time() - start_time
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def storage_arch(filename, arch):
+    """
+    architecture (directory) under which a package-file is stored:
+    architecture independent packages are stored only once, under  any
+
+    :param  filename:  filename of the package
+    :param  arch:      architecture of the repo the package belongs to
+    :return:           'any' or  arch
+    """
+
+    if '-any.pkg.tar.' in filename:
+        return 'any'
+    return arch
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def shared_storage_arch(sqliteConnection, filename, arch, sha256):
+    """
+    architecture (directory) under which a package-file of the repo of
+    arch  is stored:  an architecture independent package is shared only
+    if it's the same file as the shared one (Arch Linux ARM i.e. rebuilds
+    and re-signs them), otherwise it's stored for the architecture
+
+    :param  sqliteConnection:  SQLite3 connection object
+    :param  filename:          filename of the package
+    :param  arch:              architecture of the repo the package belongs to
+    :param  sha256:            SHA-256 of the package-file in that repo
+    :return:                   'any' or  arch
+    """
+
+    if storage_arch(filename, arch) != 'any':
+        return arch
+
+    sql = "SELECT sha256 FROM local_mirror WHERE filename=? AND arch='any';"
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (filename,))
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row is None  or  row[0] is None  or  sha256 is None  or  row[0] == sha256:
+        return 'any'
+    return arch
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def package_path(arch, repo, filename):
+    """
+    path of a package-file in the pool:  pool/<arch>/<repo>/<filename>
+    (the clients read the published snapshot, see  publish_snapshot() )
+
+    :param  arch:      architecture ('any' for shared packages)
+    :param  repo:      name of the repository
+    :param  filename:  filename of the package
+    :return:           path of the file
+    """
+
+    return os.path.join(POOL_DIR, arch, repo, filename)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_file_size(file_path):
+    """
+    size of a package-file including its signature
+
+    :param file_path:  path to the package-file
+    :return:           size in bytes (0 if the file doesn't exist)
+    """
+
+    size = 0
+    for path in (file_path, file_path + '.sig'):
+        try:
+            size += os.path.getsize(path)
+        except:
+            pass
+    return size
+# -----------------------------------------------------------------------------------
+
 # -----------------------------------------------------------------------------------
 def open_sqlite_db(db_file):
     """
@@ -89,6 +444,24 @@ def create_db_connection(db_file):
         sys.exit(1)
 # -----------------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------------
+def get_table_columns(sqliteConnection, table):
+    """
+    list the columns of a table
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   table:             name of the table
+    :return: list of column names (empty, if the table doesn't exist)
+    """
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute('PRAGMA table_info(' + table + ')')
+    columns = [row[1] for row in cursor.fetchall()]
+    cursor.close()
+
+    return columns
+# -----------------------------------------------------------------------------------
+
 # -----------------------------------------------------------------------------------
 def create_tables(sqliteConnection):
     """
@@ -103,12 +476,22 @@ def create_tables(sqliteConnection):
 
     sql_inst_packages = 'CREATE TABLE IF NOT EXISTS '                       +\
                         'installed_packages '                               +\
-                        '(name TEXT PRIMARY KEY, repo TEXT NOT NULL);'
+                        '(name TEXT NOT NULL, repo TEXT NOT NULL, '         +\
+                        'arch TEXT NOT NULL, PRIMARY KEY (name, arch));'
+
+    sql_host_packages = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'host_packages '                                    +\
+                        '(host TEXT NOT NULL, name TEXT NOT NULL, '         +\
+                        'repo TEXT NOT NULL, arch TEXT NOT NULL, '          +\
+                        'PRIMARY KEY (host, name, arch));'
 
     sql_local_mirror  = 'CREATE TABLE IF NOT EXISTS '                       +\
                         'local_mirror '                                     +\
-                        '(name TEXT, filename TEXT NOT NULL PRIMARY KEY, '  +\
-                        'repo TEXT NOT NULL, builddate INTEGER);'
+                        '(name TEXT, filename TEXT NOT NULL, '              +\
+                        'repo TEXT NOT NULL, builddate INTEGER, '           +\
+                        'size INTEGER, arch TEXT NOT NULL, sha256 TEXT, '   +\
+                        'sig_status TEXT, download_time INTEGER, '          +\
+                        'PRIMARY KEY (filename, arch));'
 
     sql_db_hashes     = 'CREATE TABLE IF NOT EXISTS '                       +\
                         'db_hashes '                                        +\
@@ -119,6 +502,72 @@ def create_tables(sqliteConnection):
                         '(db_timestamp TEXT, epoch_day INTEGER, '           +\
                         'db_url TEXT PRIMARY KEY);'
 
+    sql_repo_packages = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'repo_packages '                                    +\
+                        '(filename TEXT NOT NULL, name TEXT, '              +\
+                        'repo TEXT NOT NULL, arch TEXT NOT NULL, '          +\
+                        'version TEXT, builddate INTEGER, depends TEXT, '   +\
+                        'provides TEXT, replaces TEXT, mirror TEXT, '       +\
+                        'csize INTEGER, sha256 TEXT, pgpsig TEXT, '         +\
+                        'PRIMARY KEY (filename, arch));'
+
+    sql_repo_pkg_idx  = 'CREATE INDEX IF NOT EXISTS '                       +\
+                        'repo_packages_name ON repo_packages (name);'
+
+    sql_closure       = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'closure_packages '                                 +\
+                        '(name TEXT NOT NULL, arch TEXT NOT NULL, '         +\
+                        'repo TEXT NOT NULL, reason TEXT, '                 +\
+                        'PRIMARY KEY (name, arch));'
+
+    sql_xfer_stats    = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'xfer_stats '                                       +\
+                        '(kind TEXT NOT NULL, key TEXT NOT NULL, '          +\
+                        'hits INTEGER DEFAULT 0, misses INTEGER DEFAULT 0, '+\
+                        'hit_bytes INTEGER DEFAULT 0, '                     +\
+                        'miss_bytes INTEGER DEFAULT 0, '                    +\
+                        'hit_seconds REAL DEFAULT 0, '                      +\
+                        'miss_seconds REAL DEFAULT 0, '                     +\
+                        'last_access INTEGER DEFAULT 0, '                   +\
+                        'PRIMARY KEY (kind, key));'
+
+    sql_xfer_hosts    = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'xfer_hosts '                                       +\
+                        '(host TEXT PRIMARY KEY, last_time REAL);'
+
+    sql_runs          = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'runs '                                             +\
+                        '(run_id INTEGER PRIMARY KEY, '                     +\
+                        'start_time INTEGER, duration REAL);'
+
+    sql_run_phases    = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'run_phases '                                       +\
+                        '(run_id INTEGER NOT NULL, phase TEXT NOT NULL, '   +\
+                        'seconds REAL, count INTEGER, '                     +\
+                        'PRIMARY KEY (run_id, phase));'
+
+    sql_run_mirrors   = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'run_mirrors '                                      +\
+                        '(run_id INTEGER NOT NULL, mirror TEXT NOT NULL, '  +\
+                        'bytes INTEGER, requests INTEGER, errors INTEGER, ' +\
+                        'seconds REAL, PRIMARY KEY (run_id, mirror));'
+
+    sql_mirror_health = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'mirror_health '                                    +\
+                        '(host TEXT PRIMARY KEY, failures INTEGER, '        +\
+                        'num_opens INTEGER, open_until INTEGER);'
+
+    sql_mirror_dbs    = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'mirror_dbs '                                       +\
+                        '(mirror TEXT PRIMARY KEY, repo TEXT NOT NULL, '    +\
+                        'hash TEXT);'
+
+    sql_evicted       = 'CREATE TABLE IF NOT EXISTS '                       +\
+                        'evicted_packages '                                 +\
+                        '(name TEXT NOT NULL, arch TEXT NOT NULL, '         +\
+                        'builddate INTEGER, evict_time INTEGER, '           +\
+                        'PRIMARY KEY (name, arch));'
+
 
     # if table db_hashes doesn't have the new format (3 columns): drop table
     cursor = sqliteConnection.cursor()
@@ -130,56 +579,294 @@ def create_tables(sqliteConnection):
         pass
     cursor.close()
 
+    # tables of older versions without the column  arch  (or  pgpsig ):
+    # repo snapshots and closure are rebuilt, installed packages are kept
+    if 'pgpsig' not in get_table_columns(sqliteConnection, 'repo_packages'):
+        sqliteConnection.execute('DROP TABLE IF EXISTS repo_packages')
+    if 'arch' not in get_table_columns(sqliteConnection, 'closure_packages'):
+        sqliteConnection.execute('DROP TABLE IF EXISTS closure_packages')
+    inst_columns = get_table_columns(sqliteConnection, 'installed_packages')
+    if inst_columns  and  'arch' not in inst_columns:
+        sqliteConnection.execute('ALTER TABLE installed_packages ' +\
+                                 'RENAME TO installed_packages_old')
+    # table local_mirror of older versions has the key  filename  only
+    # (an architecture independent package may be stored per architecture
+    #  now) and maybe not yet the columns  size ,  arch ,  sha256  and
+    #  sig_status :  it's rebuilt
+    mirror_columns = get_table_columns(sqliteConnection, 'local_mirror')
+    cursor = sqliteConnection.cursor()
+    cursor.execute('PRAGMA table_info(local_mirror)')
+    mirror_keys = [row[1] for row in cursor.fetchall() if row[5]]
+    cursor.close()
+    if mirror_columns  and  'arch' not in mirror_keys:
+        sqliteConnection.execute('ALTER TABLE local_mirror ' +\
+                                 'RENAME TO local_mirror_old')
+    # evictions of older versions are recorded per filename
+    evicted_columns = get_table_columns(sqliteConnection, 'evicted_packages')
+    if 'filename' in evicted_columns:
+        sqliteConnection.execute('ALTER TABLE evicted_packages ' +\
+                                 'RENAME TO evicted_packages_old')
 
     try:
+        host_columns = get_table_columns(sqliteConnection, 'host_packages')
         sqliteConnection.execute(sql_inst_packages)
+        sqliteConnection.execute(sql_host_packages)
         sqliteConnection.execute(sql_local_mirror)
         sqliteConnection.execute(sql_db_hashes)
         sqliteConnection.execute(sql_db_downloads)
+        sqliteConnection.execute(sql_repo_packages)
+        sqliteConnection.execute(sql_repo_pkg_idx)
+        sqliteConnection.execute(sql_closure)
+        sqliteConnection.execute(sql_xfer_stats)
+        sqliteConnection.execute(sql_xfer_hosts)
+        sqliteConnection.execute(sql_runs)
+        sqliteConnection.execute(sql_run_phases)
+        sqliteConnection.execute(sql_run_mirrors)
+        sqliteConnection.execute(sql_mirror_health)
+        sqliteConnection.execute(sql_mirror_dbs)
+        sqliteConnection.execute(sql_evicted)
         sqliteConnection.commit()
     except:
         debug_print("Error: Can't create DB-tables")
         sys.exit(1)
+
+    if inst_columns  and  'arch' not in inst_columns:
+        sqliteConnection.execute('INSERT INTO installed_packages '        +\
+                                 '(name, repo, arch) '                    +\
+                                 'SELECT name, repo, ? '                  +\
+                                 'FROM installed_packages_old', (DEFAULT_ARCH,))
+        sqliteConnection.execute('DROP TABLE installed_packages_old')
+        sqliteConnection.commit()
+
+    # (kept as evictions of the whole package, the architecture is
+    #  carved from the filename)
+    if 'filename' in evicted_columns:
+        cursor = sqliteConnection.cursor()
+        cursor.execute('SELECT filename, name, evict_time FROM evicted_packages_old')
+        rows = [(name, filename.rsplit('-', 1)[-1].split('.pkg.tar')[0],
+                 evict_time) for filename, name, evict_time in cursor.fetchall()]
+        cursor.close()
+        sqliteConnection.executemany('INSERT OR REPLACE INTO evicted_packages ' +\
+                                     '(name, arch, builddate, evict_time) '   +\
+                                     'VALUES(?,?,NULL,?)', rows)
+        sqliteConnection.execute('DROP TABLE evicted_packages_old')
+        sqliteConnection.commit()
+
+    # older versions don't have the installed packages per host:
+    # keep them with an unknown host (replaced by the next import  -i )
+    if not host_columns:
+        sqliteConnection.execute('INSERT OR IGNORE INTO host_packages '      +\
+                                 '(host, name, repo, arch) '                 +\
+                                 "SELECT '', name, repo, arch "              +\
+                                 'FROM installed_packages')
+        sqliteConnection.commit()
+
+    # (the files of versions without  arch  are stored under  DEFAULT_ARCH )
+    if mirror_columns  and  'arch' not in mirror_keys:
+        columns = [column for column in ('name', 'filename', 'repo',
+                                         'builddate', 'size', 'sha256',
+                                         'sig_status')
+                   if column in mirror_columns]
+        arch = 'arch' if 'arch' in mirror_columns else '?'
+        sqliteConnection.execute('INSERT OR IGNORE INTO local_mirror '        +\
+                                 '(' + ', '.join(columns) + ', arch) '       +\
+                                 'SELECT ' + ', '.join(columns) + ', '       +\
+                                 'COALESCE(' + arch + ', ?) '                +\
+                                 'FROM local_mirror_old',
+                                 ((DEFAULT_ARCH,) if arch == '?' else ()) +
+                                 (DEFAULT_ARCH,))
+        sqliteConnection.execute('DROP TABLE local_mirror_old')
+        sqliteConnection.commit()
+        if 'arch' not in mirror_columns:
+            migrate_repo_dirs(sqliteConnection)
+    # ... and the column  download_time  may be missing, too
+    elif mirror_columns  and  'download_time' not in mirror_columns:
+        sqliteConnection.execute('ALTER TABLE local_mirror '                  +\
+                                 'ADD COLUMN download_time INTEGER')
+        sqliteConnection.commit()
+
+    moved = migrate_to_pool(sqliteConnection)
+    if migrate_shared_packages(sqliteConnection)  or  moved:
+        publish_snapshot(sqliteConnection, get_repo_list(sqliteConnection))
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def migrate_repo_dirs(sqliteConnection):
+    """
+    move the repo-directories of older versions  <repo>/
+    to  <DEFAULT_ARCH>/<repo>/
+    and leave a symlink for clients still using the old layout
+
+    :param   sqliteConnection:  SQLite3 connection object
+    """
+
+    sql = 'SELECT repo FROM local_mirror UNION SELECT repo FROM installed_packages;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql)
+    repos = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    for repo in repos:
+        new_dir = os.path.join(DEFAULT_ARCH, repo)
+        if not os.path.isdir(repo)  or  os.path.islink(repo)  or \
+           os.path.exists(new_dir):
+            continue
+        debug_print('moving directory ' + repo + ' to ' + new_dir)
+        try:
+            if not os.path.exists(DEFAULT_ARCH):
+                os.mkdir(DEFAULT_ARCH)
+            os.rename(repo, new_dir)
+            os.symlink(new_dir, repo)
+        except:
+            debug_print("Error: Can't move directory " + repo)
+            sys.exit(1)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def migrate_to_pool(sqliteConnection):
+    """
+    move the package-directories of older versions  <arch>/  (and  any/ )
+    to  pool/<arch>/ , the clients get the symlink  <arch>  to the
+    published snapshot instead  (see  publish_snapshot() )
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return: True, if a directory was moved
+    """
+
+    sql = 'SELECT arch FROM local_mirror UNION SELECT arch FROM installed_packages;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql)
+    archs = set([row[0] for row in cursor.fetchall()])
+    cursor.close()
+    archs.add('any')
+
+    moved = False
+    for arch in sorted(archs):
+        new_dir = os.path.join(POOL_DIR, arch)
+        if not os.path.isdir(arch)  or  os.path.islink(arch)  or \
+           os.path.exists(new_dir):
+            continue
+        debug_print('moving directory ' + arch + ' to ' + new_dir)
+        try:
+            if not os.path.exists(POOL_DIR):
+                os.mkdir(POOL_DIR)
+            os.rename(arch, new_dir)
+        except:
+            debug_print("Error: Can't move directory " + arch)
+            sys.exit(1)
+        moved = True
+    return moved
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def migrate_shared_packages(sqliteConnection):
+    """
+    move the architecture independent package-files, which older versions
+    stored under their architecture, to  pool/any/<repo>/
+    ( a package-file stored for an architecture because it differs from
+      the shared one stays there, see  shared_storage_arch() )
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return: True, if a package-file was moved
+    """
+
+    sql_select = 'SELECT filename, repo, arch, sha256 FROM local_mirror m '   +\
+                 "WHERE arch!='any' AND filename LIKE '%-any.pkg.tar.%' "   +\
+                 'AND NOT EXISTS (SELECT 1 FROM local_mirror a '           +\
+                 "WHERE a.filename=m.filename AND a.arch='any');"
+    sql_update = "UPDATE local_mirror SET arch='any', sha256=? "             +\
+                 'WHERE filename=? AND arch=?;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    moved = False
+    for filename, repo, arch, sha256 in rows:
+        src = package_path(arch, repo, filename)
+        dst = package_path('any', repo, filename)
+        if not os.path.exists(src):
+            continue
+        debug_print('moving ' + src + ' to ' + dst)
+        if not os.path.exists(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if not move_file(src, dst):
+            continue
+        if os.path.exists(src + '.sig'):
+            move_file(src + '.sig', dst + '.sig')
+        # the shared file is compared with the repos of all architectures
+        if sha256 is None:
+            sha256 = hash_file(dst)
+        sqliteConnection.execute(sql_update, (sha256, filename, arch))
+        moved = True
+    sqliteConnection.commit()
+    return moved
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def import_packages_files(sqliteConnection):
+def split_host_arch(name, archs):
+    """
+    split  <HOSTNAME>_<ARCH>  at the known architecture
+    (both may contain '_', i.e.  my_host_x86_64 )
+
+    :param  name:   <HOSTNAME>_<ARCH>
+    :param  archs:  configured architectures ( Arch )
+    :return:        (host, arch),  arch  is None if no known one matches
+    """
+
+    for arch in sorted(set(archs) | set([DEFAULT_ARCH]), key=len, reverse=True):
+        if name.endswith('_' + arch)  and  len(name) > len(arch) + 1:
+            return name[:-len(arch) - 1], arch
+    return name, None
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def import_packages_files(sqliteConnection, archs):
     """
     (re-)import the list of installed packages,
-    contained in the files   packages_<REPO>_<HOSTNAME>.txt
+    contained in the files   packages_<REPO>_<HOSTNAME>_<ARCH>.txt
+    ( or   packages_<REPO>_<HOSTNAME>.txt   for packages of  DEFAULT_ARCH )
+    ( the lists of the hosts (and architectures) without such files are kept )
 
     remove packages from table  local_mirror  which aren't installed (anymore)
 
     :param   sqliteConnection:  SQLite3 connection object
+    :param   archs:             configured architectures ( Arch )
     :return:
     """
 
     debug_print('importing lists of installed packages')
 
-    sql_empty  = 'DELETE FROM installed_packages;'
-    sql_insert = 'INSERT OR IGNORE INTO installed_packages '  +\
-                 '(name, repo) VALUES(?,?);'
-    sql_delete = 'DELETE FROM local_mirror ' +\
-                 'WHERE name NOT IN (SELECT name FROM installed_packages);'
+    sql_empty  = "DELETE FROM host_packages WHERE (host=? AND arch=?) OR host='';"
+    sql_insert = 'INSERT OR IGNORE INTO host_packages '  +\
+                 '(host, name, repo, arch) VALUES(?,?,?,?);'
 
-    sqliteConnection.execute(sql_empty)
+    hosts = set()
     pkg_files = glob.glob('packages_*.txt')
     for p_file in pkg_files:
         debug_print('  ' + p_file)
-        repo = p_file.split('_')[1]
-
-        if not os.path.exists(repo):
-            try:
-                os.mkdir(repo)
-            except:
-                debug_print("Error: Can't create directory  " + repo)
-                sys.exit(1)
+        # (the host name and the architecture may contain '_' themselves)
+        parts = p_file[:-4].split('_', 2)
+        if len(parts) < 3:
+            debug_print('Error: invalid file name ' + p_file)
+            continue
+        repo = parts[1]
+        host, arch = split_host_arch(parts[2], archs)
+        if arch is None:
+            arch = DEFAULT_ARCH
+
+        if (host, arch) not in hosts:
+            sqliteConnection.execute(sql_empty, (host, arch))
+            hosts.add((host, arch))
 
         with open(p_file, 'r') as f:
             lines = f.read().splitlines()
             for entry in lines:
                 try:
-                    entry = (entry.strip(), repo)
+                    entry = (host, entry.strip(), repo, arch)
                     sqliteConnection.execute(sql_insert, entry)
                 except:
                     debug_print("Error: Can't write into DB")
@@ -187,6 +874,34 @@ def import_packages_files(sqliteConnection):
 
     sqliteConnection.commit()
 
+    update_installed_packages(sqliteConnection)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def update_installed_packages(sqliteConnection):
+    """
+    fill table  installed_packages  with the packages installed on any host
+    (table  host_packages )
+
+    remove packages from table  local_mirror  which aren't installed (anymore)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return:
+    """
+
+    sql_empty  = 'DELETE FROM installed_packages;'
+    sql_insert = 'INSERT OR IGNORE INTO installed_packages '   +\
+                 '(name, repo, arch) '                         +\
+                 'SELECT name, repo, arch FROM host_packages ' +\
+                 'ORDER BY host ASC;'
+    sql_delete = 'DELETE FROM local_mirror ' +\
+                 'WHERE name NOT IN (SELECT name FROM installed_packages ' +\
+                 'UNION SELECT name FROM closure_packages);'
+
+    sqliteConnection.execute(sql_empty)
+    sqliteConnection.execute(sql_insert)
+    sqliteConnection.commit()
+
     # remove packages from table  local_mirror  which aren't installed (anymore)
     sqliteConnection.execute(sql_delete)
 
@@ -194,38 +909,165 @@ def import_packages_files(sqliteConnection):
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def get_repo_list(sqliteConnection):
+def apply_package_diffs(sqliteConnection, archs):
     """
-    read the list of repos from the installed_packages table
+    apply the changes of the installed packages, sent by the clients
+    (pacman hook  pacyard.hook ) into the sub-dir  sync  as files
+      pkgdiff_<HOSTNAME>_<ARCH>_<TIMESTAMP>.txt
+    with the lines   + <REPO> <NAME>  (installed)   or   - <REPO> <NAME>  (removed)
+    ( files still being written have to end with  .part )
+    the first diff of a host (the complete list) replaces the packages of
+    its architecture without host, taken over from older versions
+    (otherwise packages removed on the host would be kept forever)
 
     :param   sqliteConnection:  SQLite3 connection object
-    :return: list of repos
+    :param   archs:             configured architectures ( Arch )
+    :return: number of newly wanted packages
     """
 
-    debug_print("reading list of repos form the DB-table 'installed_packages'")
+    file_path_list = sorted(glob.glob(os.path.join('sync', 'pkgdiff_*.txt')))
+    if not file_path_list:
+        return 0
+
+    debug_print('applying changes of the installed packages')
+
+    sql_insert = 'INSERT OR REPLACE INTO host_packages '                    +\
+                 '(host, name, repo, arch) VALUES(?,?,?,?);'
+    sql_delete = 'DELETE FROM host_packages WHERE host=? AND name=? AND arch=?;'
+    sql_hosts  = 'SELECT DISTINCT host, arch FROM host_packages;'
+    sql_legacy = "DELETE FROM host_packages WHERE host='' AND arch=?;"
+    sql_new    = 'SELECT COUNT() FROM '                                     +\
+                 '(SELECT DISTINCT name, arch FROM host_packages) h '       +\
+                 'WHERE NOT EXISTS (SELECT 1 FROM installed_packages i '    +\
+                 'WHERE i.name=h.name AND i.arch=h.arch);'
 
-    repo_list = list()
-    sql = 'SELECT DISTINCT repo FROM installed_packages;'
     cursor = sqliteConnection.cursor()
-    cursor.execute(sql)
-    for row in cursor.fetchall():
-        debug_print(('  ' + row[0]))
-        repo_list.append(row[0])
+    cursor.execute(sql_hosts)
+    hosts = set(cursor.fetchall())
+    cursor.close()
+
+    for file_path in file_path_list:
+        # (the host name and the architecture may contain '_' themselves)
+        parts = os.path.basename(file_path)[:-4].split('_', 1)
+        if len(parts) < 2  or  '_' not in parts[1]:
+            debug_print('Error: invalid file name ' + file_path)
+            try_unlink(file_path)
+            continue
+        host, arch = split_host_arch(parts[1].rsplit('_', 1)[0], archs)
+        if arch is None:
+            debug_print('Error: architecture not configured ' + file_path)
+            try_unlink(file_path)
+            continue
+        debug_print('  ' + os.path.basename(file_path))
+        if (host, arch) not in hosts:
+            sqliteConnection.execute(sql_legacy, (arch,))
+            hosts.add((host, arch))
+
+        with open(file_path, 'r') as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            op, repo, name = fields
+            if op == '+':
+                sqliteConnection.execute(sql_insert, (host, name, repo, arch))
+            elif op == '-':
+                sqliteConnection.execute(sql_delete, (host, name, arch))
+        try_unlink(file_path)
 
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_new)
+    num_new = cursor.fetchone()[0]
     cursor.close()
-    return repo_list
+
+    update_installed_packages(sqliteConnection)
+    debug_print(str(num_new) + ' newly wanted packages')
+    return num_new
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def read_config(repo_list, file_name='config.ini'):
+def forget_host(sqliteConnection, host):
     """
-    read the config file
+    remove the lists of installed packages of a host (all architectures),
+    i.e. of a host which was decommissioned
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   host:              name of the host
+    :return: number of removed entries
+    """
+
+    sql_delete = 'DELETE FROM host_packages WHERE host=?;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_delete, (host,))
+    num_removed = cursor.rowcount
+    cursor.close()
+    sqliteConnection.commit()
+
+    update_installed_packages(sqliteConnection)
+    debug_print('removed ' + str(num_removed) + ' packages of host ' + host)
+    return num_removed
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_repo_list(sqliteConnection):
+    """
+    read the list of repos (per architecture) from the installed_packages table
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return: list of (arch, repo)
+    """
+
+    debug_print("reading list of repos form the DB-table 'installed_packages'")
+
+    repo_list = list()
+    sql = 'SELECT DISTINCT arch, repo FROM installed_packages ' +\
+          'ORDER BY arch ASC, repo ASC;'
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql)
+    for row in cursor.fetchall():
+        debug_print(('  ' + row[0] + '/' + row[1]))
+        repo_list.append((row[0], row[1]))
+
+    cursor.close()
+    return repo_list
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def parse_size(value):
+    """
+    parse a size like  500M , 50G  or  1T  (or a number of bytes)
+
+    :param  value:   size as string
+    :return:         size in bytes
+    """
+
+    value = value.strip().upper().rstrip('B')
+    factor = 1
+    for i, unit in enumerate('KMGT'):
+        if value.endswith(unit):
+            factor = 1024 ** (i + 1)
+            value = value[:-1]
+    return int(float(value) * factor)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def read_config(repo_list, file_name='config.ini'):
+    """
+    read the config file
     ( since python's configparser can't handle duplicate keys,
       a small workaround is needed )
 
+    the mirrors of a repo are read from the section  [<repo>:<arch>] ,
+    or  [<repo>]  if it doesn't exist  (likewise  [mirrorlist:<arch>] )
+
     :param:   file_name:  name of the config-file
-    :param:   repo_list:  list repos (of installed packages)
+    :param:   repo_list:  list of (arch, repo)  (of installed packages)
     :return:  dict with the parsed content
+              (the mirrors of a repo with the key  (arch, repo) ,
+               the  (arch, repo)  of the architectures to mirror ( Arch )
+               with the key  repo_list )
     """
 
     debug_print('reading ' + file_name)
@@ -260,77 +1102,270 @@ def read_config(repo_list, file_name='config.ini'):
                       config.getint('options', 'NumVersionsToKeep')
     except:
         config_dict['num_versions_to_keep'] = 3
-    config_dict['Arch'] = config.get('options', 'Arch')
-
-    mirrorlist = list()
-    if 'mirrorlist' in config.sections():
-        mirrorlist_section = config.options('mirrorlist')
-        for key in mirrorlist_section:
+    config_dict['archs'] = config.get('options', 'Arch').split()
+    try:
+        config_dict['mirror_max_failures'] = \
+                      config.getint('options', 'MirrorMaxFailures')
+    except:
+        config_dict['mirror_max_failures'] = 3
+    try:
+        config_dict['mirror_backoff'] = \
+                      config.getint('options', 'MirrorBackoff')
+    except:
+        config_dict['mirror_backoff'] = 1800
+    try:
+        config_dict['disk_quota'] = \
+                      parse_size(config.get('options', 'DiskQuota'))
+    except:
+        config_dict['disk_quota'] = None
+    try:
+        config_dict['access_window'] = \
+                      config.getint('options', 'AccessWindow')
+    except:
+        config_dict['access_window'] = 30
+    try:
+        config_dict['prometheus_textfile'] = \
+                      config.get('options', 'PrometheusTextfile')
+    except:
+        config_dict['prometheus_textfile'] = None
+    try:
+        config_dict['poll_interval'] = \
+                      config.getint('options', 'PollInterval')
+    except:
+        config_dict['poll_interval'] = 300
+    try:
+        config_dict['poll_mirrors'] = \
+                      config.getint('options', 'PollMirrors')
+    except:
+        config_dict['poll_mirrors'] = 3
+    try:
+        config_dict['sync_interval'] = \
+                      config.getint('options', 'SyncInterval')
+    except:
+        config_dict['sync_interval'] = 86400
+    try:
+        config_dict['memory_limit'] = \
+                      parse_size(config.get('options', 'MemoryLimit'))
+    except:
+        config_dict['memory_limit'] = None
+    try:
+        config_dict['signature_keyring'] = \
+                      config.get('options', 'SignatureKeyring')
+    except:
+        config_dict['signature_keyring'] = None
+    try:
+        config_dict['verify_workers'] = \
+                      config.getint('options', 'VerifyWorkers')
+    except:
+        config_dict['verify_workers'] = 2
+    try:
+        config_dict['upstream'] = \
+                      config.get('options', 'Upstream').rstrip('/')
+    except:
+        config_dict['upstream'] = None
+    try:
+        config_dict['upstream_workers'] = \
+                      config.getint('options', 'UpstreamWorkers')
+    except:
+        config_dict['upstream_workers'] = 4
+    try:
+        config_dict['snapshot_grace'] = \
+                      config.getint('options', 'SnapshotGrace')
+    except:
+        config_dict['snapshot_grace'] = 3600
+    # low-memory mode:  every worker thread has its own buffers
+    if config_dict['memory_limit']:
+        config_dict['verify_workers'] = 1
+        config_dict['upstream_workers'] = 1
+
+    def arch_section(section, arch):
+        if config.has_section(section + ':' + arch):
+            return section + ':' + arch
+        return section
+
+    def get_servers(section, arch):
+        servers = list()
+        if not config.has_section(section):
+            return servers
+        for key in config.options(section):
             if key.startswith('_server_'):
-                mirrorlist.append(config.get('mirrorlist', key))
-        mirrorlist = list(set(mirrorlist))
+                servers.append(config.get(section, key))
+            if key == 'include'  and  config.get(section, key) == 'mirrorlist':
+                servers += get_servers(arch_section('mirrorlist', arch), arch)
+        return servers
+
+    # only the configured architectures are mirrored
+    config_dict['repo_list'] = [(arch, repo) for arch, repo in repo_list
+                                if arch in config_dict['archs']]
+    for arch, repo in repo_list:
+        mirrors = set(get_servers(arch_section(repo, arch), arch))
+        config_dict[(arch, repo)] = \
+                    [mirror.replace('$repo', repo).replace('$arch', arch)
+                     for mirror in mirrors]
+
+    # the  lastupdate  files in the root of the mirrors of the mirrorlists
+    # (in the order of the config-file), polled in daemon mode
+    # ( $arch  is replaced by the architecture of the section)
+    config_dict['lastupdate_urls'] = list()
+    for section in config.sections():
+        if section != 'mirrorlist'  and  not section.startswith('mirrorlist:'):
+            continue
+        arch = section.split(':', 1)[1] if ':' in section else DEFAULT_ARCH
+        for mirror in get_servers(section, arch):
+            if '$repo' not in mirror:
+                continue
+            url = mirror.split('$repo')[0].replace('$arch', arch).rstrip('/') + \
+                  '/lastupdate'
+            if url not in config_dict['lastupdate_urls']:
+                config_dict['lastupdate_urls'].append(url)
 
-    for repo in repo_list:
-        config_dict[repo] = list()
-        repo_section = config.options(repo)
-        for key in repo_section:
-            if key.startswith('_server_'):
-                config_dict[repo].append(config.get(repo, key))
-            if key == 'include'  and  config.get(repo, key) == 'mirrorlist':
-                config_dict[repo] += mirrorlist
-        config_dict[repo] = list(set(config_dict[repo]))
+    return config_dict
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def fill_localmirror_sizes(sqliteConnection):
+    """
+    fill in the size of the package-files (including the signature)
+    in table  local_mirror , where it isn't known yet
 
-    arch = config.get('options', 'Arch')
-    for repo in repo_list:
-        for i, mirror in enumerate(config_dict[repo]):
-            config_dict[repo][i] = \
-                    mirror.replace('$repo', repo).replace('$arch', arch)
+    :param  sqliteConnection:  SQLite3 connection object
+    """
 
-    return config_dict
+    sql_select = 'SELECT filename, repo, arch FROM local_mirror ' +\
+                 'WHERE size IS NULL;'
+    sql_update = 'UPDATE local_mirror SET size=? WHERE filename=? AND arch=?;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select)
+    for filename, repo, arch in cursor.fetchall():
+        sqliteConnection.execute(sql_update,
+                                 (get_file_size(package_path(arch, repo,
+                                                             filename)),
+                                  filename, arch))
+    sqliteConnection.commit()
+    cursor.close()
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def remove_old_packages(sqliteConnection, config):
+def remove_old_packages(sqliteConnection, config, dry_run=False):
     """
-    delete older packages from DB and HDD
+    delete older packages from DB and HDD:
+      - all but the  NumVersionsToKeep  newest versions of every package
+      - if the disk usage exceeds  DiskQuota :
+        further old versions (oldest first), then packages without client
+        access during the last  AccessWindow  days (largest first)
+        (the download counts as access, so a package just downloaded
+         isn't evicted right away)
+    evictions because of the quota are recorded per package:
+    an evicted package isn't downloaded again (not even newer versions)
+    until a client requests it, evicted old versions aren't downloaded
+    again as long as they are in the repos
 
     :param  sqliteConnection:  SQLite3 connection object
     :param  config:            dict with the parsed content of the config-file
+    :param  dry_run:           only print what would be removed
+    :return:                   number of removed packages
     """
 
     debug_print("removing older packages from HDD")
 
-    sql_select = 'SELECT name, filename, repo, builddate ' +\
-                 'FROM local_mirror '                      +\
-                 'ORDER BY name ASC, builddate DESC;'
+    sql_ranked = 'SELECT filename, name, repo, arch, '                          +\
+                 'COALESCE(size, 0) AS size, builddate, download_time, '        +\
+                 'ROW_NUMBER() OVER '                                           +\
+                 '(PARTITION BY name, arch ORDER BY builddate DESC) '           +\
+                 'AS version_rank FROM local_mirror'
+    sql_old    = 'SELECT filename, name, repo, arch, size '                     +\
+                 'FROM (' + sql_ranked + ') WHERE version_rank > ?;'
+    sql_total  = 'SELECT COALESCE(SUM(size), 0) FROM local_mirror;'
+    sql_evict  = 'SELECT r.filename, r.name, r.repo, r.arch, r.size, '          +\
+                 'r.builddate, r.version_rank '                                 +\
+                 'FROM (' + sql_ranked + ') r '                                 +\
+                 'LEFT JOIN xfer_stats x '                                      +\
+                 "ON x.kind='package' AND x.key=r.name "                        +\
+                 'WHERE r.version_rank <= ? '                                   +\
+                 'AND (r.version_rank > 1 OR MAX(COALESCE(x.last_access, 0), '  +\
+                 'COALESCE(r.download_time, 0)) < ?) '                          +\
+                 'ORDER BY r.version_rank DESC, '                               +\
+                 'CASE WHEN r.version_rank > 1 THEN r.builddate '               +\
+                 'ELSE -r.size END ASC;'
+    sql_delete = 'DELETE FROM local_mirror WHERE filename=? AND arch=?;'
+    # builddate:  newest evicted old version,  NULL:  the whole package
+    sql_insert = 'INSERT INTO evicted_packages '                                +\
+                 '(name, arch, builddate, evict_time) VALUES(?,?,?,?) '         +\
+                 'ON CONFLICT(name, arch) DO UPDATE SET builddate='             +\
+                 'CASE WHEN builddate IS NULL OR excluded.builddate IS NULL '   +\
+                 'THEN NULL ELSE MAX(builddate, excluded.builddate) END, '      +\
+                 'evict_time=excluded.evict_time;'
+    # evicted packages requested by a client afterwards are wanted again,
+    # evicted old versions are forgotten when they leave the repos
+    sql_unevict = 'DELETE FROM evicted_packages '                               +\
+                  'WHERE name NOT IN (SELECT name FROM repo_packages) '         +\
+                  'OR (builddate IS NULL AND name IN (SELECT key '              +\
+                  "FROM xfer_stats WHERE kind='package' "                       +\
+                  'AND last_access > evicted_packages.evict_time)) '            +\
+                  'OR (builddate IS NOT NULL AND NOT EXISTS (SELECT 1 '         +\
+                  'FROM repo_packages r WHERE r.name=evicted_packages.name '    +\
+                  'AND r.builddate <= evicted_packages.builddate));'
 
-    remove_dict = dict()
     num_versions_to_keep = config['num_versions_to_keep']
-    last_name = None
+    fill_localmirror_sizes(sqliteConnection)
+
     cursor = sqliteConnection.cursor()
-    cursor.execute(sql_select)
+    cursor.execute(sql_old, (num_versions_to_keep,))
+    remove_list = cursor.fetchall()
+    evict_list = list()
+    evict_dates = list()
+
+    quota = config['disk_quota']
+    if quota:
+        cursor.execute(sql_total)
+        total = cursor.fetchone()[0] - sum([row[4] for row in remove_list])
+        if total > quota:
+            access_limit = int(time.time()) - config['access_window'] * 24 * 3600
+            cursor.execute(sql_evict, (num_versions_to_keep, access_limit))
+            for row in cursor.fetchall():
+                if total <= quota:
+                    break
+                evict_list.append(row[:5])
+                evict_dates.append(None if row[6] == 1 else row[5])
+                total -= row[4]
+        if total > quota:
+            debug_print('Error: disk quota exceeded by ' +
+                        str(total - quota) + ' bytes')
+    cursor.close()
 
-    for row in cursor.fetchall():
-        if row[0] != last_name:
-            last_name = row[0]
-            num_version = 1
-        else:
-            num_version += 1
-            if num_version > num_versions_to_keep:
-                remove_dict[row[1]] = row[2]
-                debug_print('  ' + row[1])
-
-    for filename in remove_dict.keys():
-        sql_delete = "DELETE FROM local_mirror " +\
-                     "WHERE filename=?;"
-        sqliteConnection.execute(sql_delete, (filename,))
-        repo = remove_dict[filename]
-        file_path = os.path.join(repo, filename)
+    freed = sum([row[4] for row in remove_list + evict_list])
+    if dry_run:
+        for filename, name, repo, arch, size in remove_list:
+            print('  old version  %10d  %s' % (size, package_path(arch, repo,
+                                                                  filename)))
+        for filename, name, repo, arch, size in evict_list:
+            print('  quota        %10d  %s' % (size, package_path(arch, repo,
+                                                                  filename)))
+        print('%d packages, %d bytes (%.1f MB) would be freed' %
+              (len(remove_list) + len(evict_list), freed, freed / 1048576.0))
+        return 0
+
+    now = int(time.time())
+    sqliteConnection.executemany(sql_delete,
+                                 [(row[0], row[3])
+                                  for row in remove_list + evict_list])
+    sqliteConnection.executemany(sql_insert,
+                                 [(row[1], row[3], builddate, now)
+                                  for row, builddate in zip(evict_list,
+                                                            evict_dates)])
+    sqliteConnection.execute(sql_unevict)
+    sqliteConnection.commit()
+
+    for filename, name, repo, arch, size in remove_list + evict_list:
+        debug_print('  ' + filename)
+        file_path = package_path(arch, repo, filename)
         try_unlink(file_path)
         try_unlink(file_path + '.sig')
 
-    sqliteConnection.commit()
-    cursor.close()
+    if remove_list or evict_list:
+        debug_print('freed ' + str(freed) + ' bytes')
+    return len(remove_list) + len(evict_list)
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
@@ -376,26 +1411,30 @@ def remove_old_dbdownloads(sqliteConnection):
 # -----------------------------------------------------------------------------------
 def remove_package_files_not_in_db(sqliteConnection, repo_list):
     """
-    remove packages files from HDD which are not listed in the DB
+    remove packages files from the pool which are not listed in the DB
+    (the published snapshot keeps them until the next publish)
 
     :param   sqliteConnection:  SQLite3 connection object
-    :param   repo_list:         list of repositories
+    :param   repo_list:         list of (arch, repo)
     """
 
     debug_print("removing package-files from HDD which are not in DB")
 
-    for repo in repo_list:
-        file_path_list = glob.glob(repo + '/*.pkg.*')
+    repo_dirs = set()
+    for arch, repo in repo_list:
+        repo_dirs.add((arch, repo))
+        repo_dirs.add(('any', repo))
 
-        # remove .sig - files from listing
-        for i, file_path in enumerate(file_path_list):
-            if file_path.endswith('.sig'):
-                file_path_list[i] = file_path[:-4]
-        file_path_list = set(file_path_list)
+    for arch, repo in sorted(repo_dirs):
+        repo_dir = os.path.join(POOL_DIR, arch, repo)
+        # package-files (.sig - files are removed with their package-file)
+        file_path_list = set([file_path[:-4] if file_path.endswith('.sig')
+                              else file_path
+                              for file_path in glob.iglob(repo_dir + '/*.pkg.*')])
 
         for file_path in file_path_list:
             filename = os.path.basename(file_path)
-            if not is_in_localmirror(sqliteConnection, filename):
+            if not is_in_localmirror(sqliteConnection, filename, arch):
                 debug_print(' removing package ' + filename)
                 try_unlink(file_path)
                 try_unlink(file_path + '.sig')
@@ -408,30 +1447,36 @@ def cleanup_table_localmirror(sqliteConnection):
     when the package-file doesn't exist (anymore) on harddrive
 
     :param   sqliteConnection:  SQLite3 connection object
-    :return: list of repos
+    :return: number of removed entries
     """
 
     debug_print("cleaning up DB-table 'local_mirror'")
 
-    sql_select = 'SELECT filename, repo FROM local_mirror;'
+    sql_select = 'SELECT filename, repo, arch FROM local_mirror;'
     cursor = sqliteConnection.cursor()
     cursor.execute(sql_select)
 
-    for row in cursor.fetchall():
-        file_path = os.path.join(row[1], row[0])
+    # iterate the cursor (instead of fetching all rows),
+    # only the missing files are collected
+    missing = list()
+    for row in cursor:
+        file_path = package_path(row[2], row[1], row[0])
         if not os.path.exists(file_path):
             debug_print('removing package ' + \
                          os.path.basename(file_path) + ' from DB')
-            sql_delete = "DELETE FROM local_mirror " +\
-                         "WHERE filename=?;"
-            sqliteConnection.execute(sql_delete, (row[0],))
+            missing.append((row[0], row[2]))
+    cursor.close()
 
+    sql_delete = "DELETE FROM local_mirror " +\
+                 "WHERE filename=? AND arch=?;"
+    sqliteConnection.executemany(sql_delete, missing)
     sqliteConnection.commit()
-    cursor.close()
+    return len(missing)
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def update_table_localmirror(sqliteConnection, name, filename, repo, builddate):
+def update_table_localmirror(sqliteConnection, name, filename, repo, arch,
+                             builddate, sha256):
     """
     insert record (in case it doesn't exist) into table local_mirror
 
@@ -439,23 +1484,43 @@ def update_table_localmirror(sqliteConnection, name, filename, repo, builddate):
     :param name:      name of the package
     :param filename:  filename of the package
     :param repo:      repository
+    :param arch:      architecture ('any' for shared packages)
     :param builddate: builddate of the package file
+    :param sha256:    SHA-256 of the package-file (from the repo snapshot)
     """
 
     debug_print('-> DB-table "local_mirror": ' + filename)
 
     sql_insert = 'INSERT OR IGNORE INTO local_mirror '  +\
-                 '(name, filename, repo, builddate) VALUES(?,?,?,?);'
+                 '(name, filename, repo, arch, builddate, size, sha256, '  +\
+                 'download_time) VALUES(?,?,?,?,?,?,?,?);'
 
-    values = (name, filename, repo, builddate)
+    size = get_file_size(package_path(arch, repo, filename))
+    values = (name, filename, repo, arch, builddate, size, sha256,
+              int(time.time()))
     sqliteConnection.execute(sql_insert, values)
     sqliteConnection.commit()
 # -----------------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------------
+def get_session():
+    """
+    HTTP session of the process (in daemon mode kept between the runs),
+    so that the connections to the mirrors are reused
+
+    :return:  requests.Session
+    """
+
+    if daemon_state['session'] is None:
+        daemon_state['session'] = requests.Session()
+    return daemon_state['session']
+# -----------------------------------------------------------------------------------
+
 # -----------------------------------------------------------------------------------
 def download(url, file_path):
     """
     download the file and save it under file_path
+    (http(s) with the session of the process, other protocols with wget)
 
     :param  url:   url to the file
     :file_path:    path/filename where to save the file
@@ -468,24 +1533,40 @@ def download(url, file_path):
     else:
         debug_print('[downloading ] ' + os.path.basename(file_path))
 
-    cmd = "wget -c -T 5 -O '" + file_path + "' " + url
+    if urlparse(url).scheme in ('http', 'https'):
+        start_time = time.time()
+        success, num_bytes = fetch_verified(get_session(), url, file_path,
+                                            None, None)
+        add_mirror_stats(url, num_bytes, start_time, error=not success)
+        if not success:
+            debug_print("Error: Can't download file")
+        return success
+
+    # (as  .part  file first, so that an incomplete file is never taken
+    #  for a complete one)
+    cmd = "wget -c -T 5 -O '" + file_path + ".part' " + url
     if not verbose:
         cmd += ' > /dev/null 2>&1'
 
+    start_time = time.time()
     try:
         return_value = os.system(cmd)
         if return_value == 0:
+            os.rename(file_path + '.part', file_path)
+            add_mirror_stats(url, os.path.getsize(file_path), start_time)
             return True
         else:
             raise
     except:
+        add_mirror_stats(url, 0, start_time, error=True)
         debug_print("Error: Can't download file")
-        try_unlink(file_path)
+        try_unlink(file_path + '.part')
         return False
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def download_db(sqliteConnection, mirror, repo, arch):
+@log_indented
+def download_db(sqliteConnection, mirror, repo, arch, config):
     """
     download the <repo>.db.tar.gz - file from the mirror
     and calculate it's md5-hash
@@ -495,6 +1576,7 @@ def download_db(sqliteConnection, mirror, repo, arch):
     :param  mirror            url of the mirror (containing $repo and $arch)
     :param  repo:             name of the repository
     :param  arch:             architecture
+    :param  config:           dict with the parsed content of the config-file
     :return:                  path of the downloaded file, md5sum
     """
 
@@ -507,12 +1589,15 @@ def download_db(sqliteConnection, mirror, repo, arch):
 
     try:
         from subprocess import Popen, PIPE
+        start_time = time.time()
         response = Popen('curl -kI ' + db_url + ' 2>&1',
                           shell=True, stdout=PIPE).stdout.read()
+        add_mirror_stats(db_url, 0, start_time)
         for val in response.split('\r\n'):
             if val.lower().startswith('last-modified'):
                 db_timestamp = val[15:]
-        if is_db_known(sqliteConnection, db_url, db_timestamp):
+        if is_db_known(sqliteConnection, db_url, db_timestamp)  and \
+           is_repo_known(sqliteConnection, repo, arch):
             debug_print('skipping download of repo DB-file (known database)')
             return None, None
     except:
@@ -523,13 +1608,13 @@ def download_db(sqliteConnection, mirror, repo, arch):
     try_unlink(file_path)
 
     status = download(db_url, file_path)
+    record_mirror_result(sqliteConnection, config, db_url, status)
     if status is False:
         return None, None
 
     add_known_db(sqliteConnection, db_url, db_timestamp)
 
-    with open(file_path, 'rb') as f:
-        md5sum = hashlib.md5(f.read()).hexdigest()
+    md5sum = hash_file(file_path, 'md5')
 
     return file_path, md5sum
 # -----------------------------------------------------------------------------------
@@ -588,94 +1673,119 @@ def add_known_db(sqliteConnection, db_url, db_timestamp):
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def get_repo_content(file_path):
+def parse_desc(lines):
     """
-    get the content of the downloaded <repo>.db.tar.gz - file
-    and delete the file
+    parse the lines of a  desc - file of the repo-DB
+    ( sections like  %NAME%  followed by one or more values,
+      terminated by an empty line )
+
+    :param   lines:   lines (bytes) of the desc - file
+    :return:          dict  section -> list of values
+    """
+
+    desc = dict()
+    section = None
+    for line in lines:
+        line = line.decode('utf-8').strip()
+        if not line:
+            section = None
+        elif line.startswith('%') and line.endswith('%'):
+            section = line
+            desc[section] = list()
+        elif section is not None:
+            desc[section].append(line)
+
+    return desc
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def iter_repo_content(file_path):
+    """
+    generator:  the content of the <repo>.db.tar.gz - file, one package
+    at a time
+    ( the members of the archive are read one after the other
+      and not kept in memory )
 
     :param   file_path   path of the repo.db - file
-    :return:             dict with the content of the repo
-                         (%FILENAME% , %FILE% , %BUILDDATE%)
+    :return:             (filename, (name, builddate, version,
+                                     depends, provides, replaces,
+                                     csize, sha256, pgpsig))
+                         depends, provides and replaces space separated,
+                         pgpsig: base64 encoded signature (or None)
     """
 
-    repo_content = dict()
     debug_print('extracting repo DB-file ...')
     with tarfile.open(file_path, "r:gz") as tar:
         debug_print('collecting package info ...')
 
-        for member in tar.getmembers():
+        for member in tar:
+            # TarFile caches every member read, drop them
+            tar.members = []
             if not member.name.endswith("/desc"):
                 continue
             debug_print(member.name[:-5], end='\r')
             f = tar.extractfile(member)
-            lines = f.readlines()
+            desc = parse_desc(f.readlines())
             f.close()
 
-            file_name = name = builddate = None
-            lines[0] = lines[0].decode('utf-8').strip()
-            for i, line in enumerate(lines[1:]):
-                try:
-                    lines[i+1] = line.decode('utf-8').strip()
-                    if lines[i] == '%FILENAME%':
-                        filename = lines[i+1]
-                    elif lines[i] == '%NAME%':
-                        name = lines[i+1]
-                    elif lines[i] == '%BUILDDATE%':
-                        builddate = int(lines[i+1])
-                    if filename and name and builddate:
-                        repo_content[filename] = [name, builddate]
-                        debug_print("Error: in get_repo_content() " +\
-                               file_path + " " + member)
-                        sys.exit(1)
-                except:
-                    pass
+            try:
+                filename = desc['%FILENAME%'][0]
+                name = desc['%NAME%'][0]
+                builddate = int(desc['%BUILDDATE%'][0])
+                csize = int(desc['%CSIZE%'][0]) if '%CSIZE%' in desc else None
+            except:
+                debug_print("Error: in get_repo_content() " +\
+                            file_path + " " + member.name)
+                continue
 
-    debug_print(' ', end='\r')
-    try_unlink(file_path)
+            yield filename, (name, builddate,
+                             desc.get('%VERSION%', [None])[0],
+                             ' '.join(desc.get('%DEPENDS%', [])),
+                             ' '.join(desc.get('%PROVIDES%', [])),
+                             ' '.join(desc.get('%REPLACES%', [])),
+                             csize,
+                             desc.get('%SHA256SUM%', [None])[0],
+                             desc.get('%PGPSIG%', [None])[0])
 
-    return repo_content
+    debug_print(' ', end='\r')
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def is_installed(sqliteConnection, name):
+def get_repo_content(file_path):
     """
-    check, whether the package  name  is in the list of installed packages
+    get the content of the downloaded <repo>.db.tar.gz - file
+    and delete the file
 
-    :param  sqliteConnection     SQlite3 connection
-    :param  name:                name of the package
-    :return
+    :param   file_path   path of the repo.db - file
+    :return:             dict with the content of the repo
+                         filename -> (name, builddate, version,
+                                      depends, provides, replaces,
+                                      csize, sha256, pgpsig)
     """
 
-    sql = "SELECT COUNT() "              +\
-          "FROM installed_packages "     +\
-          "WHERE name=?;"
-
-    cursor = sqliteConnection.cursor()
-    cursor.execute(sql, (name,))
-    numberOfRows = cursor.fetchone()[0]
-    cursor.close()
+    repo_content = dict(iter_repo_content(file_path))
+    try_unlink(file_path)
 
-    if numberOfRows == 0:
-        return False
-    else:
-        return True
+    return repo_content
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def is_in_localmirror(sqliteConnection, filename):
+def is_in_localmirror(sqliteConnection, filename, arch=None):
     """
     check, whether the package  filename  is in table  local_mirror
 
     :param  sqliteConnection     SQlite3 connection
     :param  filename:            filename of the paackage
+    :param  arch:                architecture of the storage
+                                 (None: any)
     :return
     """
 
     sql = "SELECT COUNT() FROM local_mirror " +\
-          "WHERE filename=?;"
+          "WHERE filename=? AND arch=COALESCE(?, arch);"
 
     cursor = sqliteConnection.cursor()
-    cursor.execute(sql, (filename,))
+    cursor.execute(sql, (filename, arch))
     numberOfRows = cursor.fetchone()[0]
     cursor.close()
 
@@ -730,23 +1840,24 @@ def add_hash(sqliteConnection, hash_dbfile):
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def get_num_of_new_packages(sqliteConnection, name, filename, builddate):
+def get_num_of_new_packages(sqliteConnection, name, arch, builddate):
     """
     return the number of packages 'already in the local mirror
     with a newer or equally new builddate
 
     :param  sqliteConnection     SQlite3 connection
     :param  name:                name of the paackage
-    :param  filename:            filename of the package
+    :param  arch:                architecture
+                                 (shared packages of  any  count as well)
     :return
     """
 
     sql = "SELECT COUNT() FROM local_mirror"    + \
-          " WHERE name=?"                       + \
+          " WHERE name=? AND arch IN (?, 'any')"+ \
           " AND builddate >= " + str(builddate) + ";"
 
     cursor = sqliteConnection.cursor()
-    cursor.execute(sql, (name,))
+    cursor.execute(sql, (name, arch))
     numberOfRows = cursor.fetchone()[0]
     cursor.close()
 
@@ -754,118 +1865,2181 @@ def get_num_of_new_packages(sqliteConnection, name, filename, builddate):
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def update_localmirror(sqliteConnection, repo_list, config):
+def is_repo_known(sqliteConnection, repo, arch):
     """
-    update the local mirror:
-      for every repo and every mirror for this repo:
-        download newer versions of the installed packages
-        and update DB
+    check, whether a snapshot of the repo is stored in table  repo_packages
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  repo:                name of the repository
+    :param  arch:                architecture
+    :return
+    """
+
+    sql = "SELECT COUNT() FROM repo_packages " +\
+          "WHERE repo=? AND arch=?;"
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (repo, arch))
+    numberOfRows = cursor.fetchone()[0]
+    cursor.close()
+
+    if numberOfRows == 0:
+        return False
+    else:
+        return True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def update_table_repo_packages(sqliteConnection, repo, arch, mirror,
+                               repo_content):
+    """
+    store the content of a repo DB-file as snapshot of the repo
+    in table  repo_packages
+    ( a DB-file older than the stored snapshot - i.e. from a mirror
+      which isn't up to date - is ignored )
+
+    the content is streamed into a temporary table first, so that it
+    doesn't have to be kept in memory
 
     :param   sqliteConnection:  SQLite3 connection object
-    :param   repo_list:         list of repositories
-    :param   config:            dict with the parsed content of the config-file
-    :return:
+    :param   repo:              name of the repository
+    :param   arch:              architecture
+    :param   mirror:            url of the mirror the DB-file came from
+    :param   repo_content:      dict with the content of the repo,
+                                or iterable of (filename, entry)
+                                (see  iter_repo_content() )
+    :return:                    number of stored packages
+                                (0, if the snapshot wasn't stored)
     """
 
-    debug_print('updating local mirror')
+    if isinstance(repo_content, dict):
+        repo_content = repo_content.items()
+
+    sql_staging = 'CREATE TEMP TABLE IF NOT EXISTS repo_staging '          +\
+                  '(filename TEXT, name TEXT, builddate INTEGER, '         +\
+                  'version TEXT, depends TEXT, provides TEXT, '            +\
+                  'replaces TEXT, csize INTEGER, sha256 TEXT, pgpsig TEXT);'
+    sql_fill    = 'INSERT INTO repo_staging VALUES(?,?,?,?,?,?,?,?,?,?);'
+    sql_newest  = 'SELECT COUNT(), MAX(builddate) FROM repo_staging;'
+    sql_select  = 'SELECT MAX(builddate) FROM repo_packages '              +\
+                  'WHERE repo=? AND arch=?;'
+    sql_delete  = 'DELETE FROM repo_packages WHERE repo=? AND arch=?;'
+    sql_insert  = 'INSERT OR REPLACE INTO repo_packages '                  +\
+                  '(filename, name, repo, arch, version, builddate, '      +\
+                  'depends, provides, replaces, mirror, csize, sha256, '   +\
+                  'pgpsig) '                                               +\
+                  'SELECT filename, name, ?, ?, version, builddate, '      +\
+                  'depends, provides, replaces, ?, csize, sha256, pgpsig ' +\
+                  'FROM repo_staging;'
+    sql_empty   = 'DELETE FROM repo_staging;'
+
+    sqliteConnection.execute(sql_staging)
+    sqliteConnection.execute(sql_empty)
+    sqliteConnection.executemany(sql_fill, ((filename,) + tuple(entry)
+                                            for filename, entry in repo_content))
 
-    arch = config['Arch']
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_newest)
+    num_packages, newest = cursor.fetchone()
+    cursor.execute(sql_select, (repo, arch))
+    known_newest = cursor.fetchone()[0]
+    cursor.close()
 
-    for repo in repo_list:
-        for mirror in config[repo]:
-            file_path, hash_dbfile = download_db(sqliteConnection, mirror, repo, arch)
+    if not num_packages:
+        sqliteConnection.commit()
+        return 0
+    if known_newest is not None  and  newest < known_newest:
+        debug_print('skipping repo DB-file (older than known snapshot)')
+        sqliteConnection.execute(sql_empty)
+        sqliteConnection.commit()
+        return 0
 
-            if hash_dbfile is None:
-                continue
-            if is_hash_known(sqliteConnection, hash_dbfile):
-                debug_print('skipping repo DB-file (known hash of database)')
-                continue
-            add_hash(sqliteConnection, hash_dbfile)
+    debug_print('-> DB-table "repo_packages": ' + arch + '/' + repo)
+
+    sqliteConnection.execute(sql_delete, (repo, arch))
+    sqliteConnection.execute(sql_insert, (repo, arch, mirror))
+    sqliteConnection.execute(sql_empty)
+    sqliteConnection.commit()
+    return num_packages
+# -----------------------------------------------------------------------------------
 
-            repo_content = get_repo_content(file_path)
-            for filename in repo_content.keys():
-                name, builddate = repo_content[filename]
+# -----------------------------------------------------------------------------------
+def split_dependency(dep):
+    """
+    split a dependency (or provides-entry) like  glibc>=2.38
+    into name, comparison operator and version
 
-                if not is_installed(sqliteConnection, name):
-                    debug_print(' [not installed  ] ' + filename, end='\r')
-                    continue
-                num = get_num_of_new_packages(sqliteConnection,
-                                              name, filename, builddate)
-                if num >= config['num_versions_to_keep']:
-                    debug_print(' [version too old] ' + filename, end='\r')
-                    continue
+    :param  dep:   dependency string
+    :return:       name, operator, version  (operator and version may be None)
+    """
 
-                file_path = os.path.join(repo, filename)
-                url = mirror.replace('$repo', repo).replace('$arch', arch)
-                url = os.path.join(url, filename)
-                debug_print(' ', end='\r')
-                download(url, file_path)
-                url += '.sig'
-                file_path += '.sig'
-                download(url, file_path)
-                update_table_localmirror(sqliteConnection, name,
-                                         filename, repo, builddate)
+    for op in ('>=', '<=', '=', '>', '<'):
+        pos = dep.find(op)
+        if pos > 0:
+            return dep[:pos], op, dep[pos + len(op):]
+    return dep, None, None
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def create_sub_dirs(repo_list):
+def rpmvercmp(ver1, ver2):
     """
-    Create the sub-dirs (if they don't exist)
-    one for each resp, for the package-files
-    plus a tmp-dir (for the <reponame>.db.tar.gz - files)
+    compare two version strings segment by segment
+    ( same algorithm as pacman's  rpmvercmp() )
 
-    :param   repo_list:    list of repositories
+    :param  ver1:  1st version string
+    :param  ver2:  2nd version string
+    :return:       -1, 0, 1   if ver1 is older, equal, newer than ver2
     """
 
-    def create_sub_dir(sub_dir):
-        if not os.path.exists(sub_dir):
-            try:
-                os.mkdir(sub_dir)
-            except:
-                print("Error:  Can't create sub-dir " + sub_dir)
-                sys.exit(1)
+    if ver1 == ver2:
+        return 0
+
+    len1 = len(ver1)
+    len2 = len(ver2)
+    one = two = 0
+    while one < len1  and  two < len2:
+        ptr1 = one
+        ptr2 = two
+        while one < len1  and  not ver1[one].isalnum():
+            one += 1
+        while two < len2  and  not ver2[two].isalnum():
+            two += 1
+        if one >= len1  or  two >= len2:
+            break
+
+        # different lengths of the separators
+        if (one - ptr1) != (two - ptr2):
+            return -1 if (one - ptr1) < (two - ptr2) else 1
+
+        ptr1 = one
+        ptr2 = two
+        is_num = ver1[ptr1].isdigit()
+        if is_num:
+            while ptr1 < len1  and  ver1[ptr1].isdigit():
+                ptr1 += 1
+            while ptr2 < len2  and  ver2[ptr2].isdigit():
+                ptr2 += 1
+        else:
+            while ptr1 < len1  and  ver1[ptr1].isalpha():
+                ptr1 += 1
+            while ptr2 < len2  and  ver2[ptr2].isalpha():
+                ptr2 += 1
+
+        seg1 = ver1[one:ptr1]
+        seg2 = ver2[two:ptr2]
+
+        # segments of different types: numeric is newer than alpha
+        if not seg2:
+            return 1 if is_num else -1
+
+        if is_num:
+            seg1 = seg1.lstrip('0')
+            seg2 = seg2.lstrip('0')
+            if len(seg1) != len(seg2):
+                return -1 if len(seg1) < len(seg2) else 1
+        if seg1 != seg2:
+            return -1 if seg1 < seg2 else 1
+
+        one = ptr1
+        two = ptr2
+
+    if one >= len1  and  two >= len2:
+        return 0
+
+    # a remaining alpha string never beats an empty string
+    if (one >= len1  and  not ver2[two].isalpha())  or \
+       (one < len1  and  ver1[one].isalpha()):
+        return -1
+    return 1
+# -----------------------------------------------------------------------------------
 
-    for sub_dir in repo_list:
-        create_sub_dir(sub_dir)
-    create_sub_dir('tmp')
+# -----------------------------------------------------------------------------------
+def vercmp(ver1, ver2):
+    """
+    compare two package versions  [epoch:]pkgver[-pkgrel]
+    ( the pkgrel is only compared if both versions have one )
+
+    :param  ver1:  1st version
+    :param  ver2:  2nd version
+    :return:       -1, 0, 1   if ver1 is older, equal, newer than ver2
+    """
+
+    def parse_evr(version):
+        epoch = '0'
+        if ':' in version:
+            epoch, version = version.split(':', 1)
+        release = None
+        if '-' in version:
+            version, release = version.rsplit('-', 1)
+        return epoch or '0', version, release
+
+    epoch1, version1, release1 = parse_evr(ver1)
+    epoch2, version2, release2 = parse_evr(ver2)
+
+    ret = rpmvercmp(epoch1, epoch2)
+    if ret == 0:
+        ret = rpmvercmp(version1, version2)
+        if ret == 0  and  release1 is not None  and  release2 is not None:
+            ret = rpmvercmp(release1, release2)
+    return ret
 # -----------------------------------------------------------------------------------
 
 # -----------------------------------------------------------------------------------
-def main(work_dir, database_file, config_file):
+def is_version_satisfied(version, op, required_version):
     """
-    - update the local mirror, or
-    - (re-)import the list of installed packages
+    check, whether  version  satisfies a versioned constraint
 
-    :param work_dir:        working directory (with database and config-file)
-    :param database_file:   SQLite3 - dataabase
-    :param config_file:     configuration-file
-    :return:
+    :param  version:           version of the package (or provides-entry)
+    :param  op:                comparison operator (or None)
+    :param  required_version:  version demanded by the constraint
+    :return:                   True or False
     """
 
-    global verbose
-    if "-v" in sys.argv:
-        verbose = True
+    if op is None:
+        return True
+    if version is None:
+        return False
 
-    os.chdir(work_dir)
-    sqliteConnection = open_sqlite_db(database_file)
+    ret = vercmp(version, required_version)
+    return { '>=': ret >= 0,
+             '<=': ret <= 0,
+             '=':  ret == 0,
+             '>':  ret > 0,
+             '<':  ret < 0 }[op]
+# -----------------------------------------------------------------------------------
 
-    if '-i' in sys.argv:
-        import_packages_files(sqliteConnection)
-        sys.exit(0)
+# -----------------------------------------------------------------------------------
+class RepoIndex(object):
+    """
+    index  name -> (repo, version, depends)  of the newest version of the
+    packages of an architecture (in table  repo_packages ),
+    looked up on demand:  only the visited packages are kept in memory
+    """
 
-    cleanup_table_localmirror(sqliteConnection)
-    repo_list = get_repo_list(sqliteConnection)
-    config = read_config(repo_list, config_file)
-    create_sub_dirs(repo_list)
+    __slots__ = ('sqliteConnection', 'arch', 'cache')
+
+    def __init__(self, sqliteConnection, arch):
+        self.sqliteConnection = sqliteConnection
+        self.arch = arch
+        self.cache = dict()
+
+    def get(self, name):
+        if name not in self.cache:
+            sql = 'SELECT repo, version, depends FROM repo_packages '    +\
+                  'WHERE name=? AND arch=? ORDER BY builddate DESC LIMIT 1;'
+            cursor = self.sqliteConnection.cursor()
+            cursor.execute(sql, (name, self.arch))
+            self.cache[name] = cursor.fetchone()
+            cursor.close()
+        return self.cache[name]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        entry = self.get(name)
+        if entry is None:
+            raise KeyError(name)
+        return entry
+# -----------------------------------------------------------------------------------
 
-    update_localmirror(sqliteConnection, repo_list, config)
+# -----------------------------------------------------------------------------------
+def resolve_dependency(dep, packages, providers, wanted):
+    """
+    find the package which satisfies the dependency  dep
+
+    :param  dep:        dependency string (like  glibc>=2.38)
+    :param  packages:   index  name -> (repo, version, depends)
+                        (see  RepoIndex )
+    :param  providers:  index  provided name -> list of (name, version)
+    :param  wanted:     set of names of already wanted packages
+    :return:            name of the package to add,
+                        or None if the dependency is already satisfied
+                        (or can't be satisfied by the known repos)
+    """
 
-    remove_old_dbhashes(sqliteConnection)
-    remove_old_dbdownloads(sqliteConnection)
-    remove_old_packages(sqliteConnection, config)
-    remove_package_files_not_in_db(sqliteConnection, repo_list)
+    dep_name, op, dep_version = split_dependency(dep)
+
+    candidates = list()
+    if dep_name in packages  and \
+       is_version_satisfied(packages[dep_name][1], op, dep_version):
+        candidates.append(dep_name)
+    for name, version in providers.get(dep_name, []):
+        if is_version_satisfied(version, op, dep_version):
+            candidates.append(name)
+
+    for name in candidates:
+        if name in wanted:
+            return None
+    # the package of that name itself (like pacman), otherwise the first
+    # of the providers
+    if dep_name in candidates:
+        return dep_name
+    if candidates:
+        return sorted(candidates)[0]
+    return None
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def update_closure(sqliteConnection):
+    """
+    resolve the transitive dependency closure of the installed packages
+    of every architecture
+    (following  %DEPENDS% , %PROVIDES%  and  %REPLACES%  of the repo snapshots)
+    and store the packages added by it in table  closure_packages
+
+    remove packages from table  local_mirror  which aren't wanted (anymore)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return: dict  (arch, name) -> reason  of the packages added by the closure
+    """
+
+    debug_print('resolving dependency closure of the installed packages')
+
+    sql_archs   = 'SELECT DISTINCT arch FROM installed_packages;'
+    sql_select  = 'SELECT name, provides, replaces '                       +\
+                  'FROM repo_packages WHERE arch=? ORDER BY builddate ASC;'
+    sql_inst    = 'SELECT name FROM installed_packages WHERE arch=?;'
+    sql_empty   = 'DELETE FROM closure_packages;'
+    sql_insert  = 'INSERT OR IGNORE INTO closure_packages ' +\
+                  '(name, arch, repo, reason) VALUES(?,?,?,?);'
+    sql_delete  = 'DELETE FROM local_mirror ' +\
+                  'WHERE name NOT IN (SELECT name FROM installed_packages ' +\
+                  'UNION SELECT name FROM closure_packages);'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_archs)
+    archs = [row[0] for row in cursor.fetchall()]
+
+    closure = dict()
+    sqliteConnection.execute(sql_empty)
+    for arch in archs:
+        # the packages are looked up on demand, only the provided and
+        # replaced names (of the newest version of every package) are indexed
+        packages  = RepoIndex(sqliteConnection, arch)
+        providers = dict()
+        replacers = dict()
+
+        provides_of = dict()
+        cursor.execute(sql_select, (arch,))
+        for name, provides, replaces in cursor:
+            if provides  or  replaces:
+                provides_of[name] = (provides, replaces)
+            else:
+                provides_of.pop(name, None)
+        cursor.execute(sql_inst, (arch,))
+        installed = set([row[0] for row in cursor])
+
+        for name, (provides, replaces) in provides_of.items():
+            for provide in (provides or '').split():
+                provide_name, op, provide_version = split_dependency(provide)
+                providers.setdefault(provide_name, []).append(
+                                   (name, provide_version if op == '=' else None))
+            for replace in (replaces or '').split():
+                replacers.setdefault(split_dependency(replace)[0], []).append(name)
+        del provides_of
+
+        wanted = set(installed)
+        added  = dict()
+        queue  = list()
+
+        def want(name, reason):
+            if name is not None  and  name not in wanted:
+                wanted.add(name)
+                added[name] = reason
+                queue.append(name)
+
+        for name in sorted(installed):
+            # renamed / replaced packages
+            for replacer in sorted(replacers.get(name, [])):
+                want(replacer, 'replaces ' + name)
+            if name in packages:
+                queue.append(name)
+            else:
+                want(resolve_dependency(name, packages, providers, wanted),
+                     'provides ' + name)
+
+        while queue:
+            name = queue.pop()
+            for dep in (packages[name][2] or '').split():
+                want(resolve_dependency(dep, packages, providers, wanted),
+                     'dependency of ' + name)
+
+        for name in sorted(added.keys()):
+            debug_print('  + ' + arch + '/' + name + '  (' + added[name] + ')')
+            sqliteConnection.execute(sql_insert,
+                                     (name, arch, packages[name][0], added[name]))
+            closure[(arch, name)] = added[name]
+    cursor.close()
+
+    sqliteConnection.execute(sql_delete)
+    sqliteConnection.commit()
+
+    debug_print(str(len(closure)) + ' packages added by the dependency closure')
+    return closure
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_download_plan(sqliteConnection):
+    """
+    list the package-files of the wanted packages
+    (installed packages and their dependency closure)
+    which are not yet in the local mirror (and weren't evicted because
+    of the disk quota, in any version)
+    ( an architecture independent package is listed for an architecture
+      if the shared file differs from the one of its repo )
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :return: list of (filename, name, repo, arch, builddate, mirror,
+             csize, sha256),  newest version of each package first
+    """
+
+    sql = 'SELECT filename, name, repo, arch, builddate, mirror, '          +\
+          'csize, sha256 '                                                  +\
+          'FROM repo_packages p '                                           +\
+          'WHERE (EXISTS (SELECT 1 FROM installed_packages i '              +\
+          'WHERE i.name=p.name AND i.arch=p.arch) '                         +\
+          'OR EXISTS (SELECT 1 FROM closure_packages c '                    +\
+          'WHERE c.name=p.name AND c.arch=p.arch)) '                        +\
+          'AND NOT EXISTS (SELECT 1 FROM local_mirror m '                   +\
+          'WHERE m.filename=p.filename AND (m.arch=p.arch '                 +\
+          "OR (m.arch='any' AND (m.sha256 IS NULL OR p.sha256 IS NULL "     +\
+          'OR m.sha256=p.sha256)))) '                                       +\
+          'AND NOT EXISTS (SELECT 1 FROM evicted_packages e '               +\
+          "WHERE e.name=p.name AND e.arch IN (p.arch, 'any') "              +\
+          'AND (e.builddate IS NULL OR p.builddate <= e.builddate)) '       +\
+          'ORDER BY name ASC, arch ASC, builddate DESC;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql)
+    plan = cursor.fetchall()
+    cursor.close()
+
+    return plan
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def print_closure_report(sqliteConnection):
+    """
+    print the packages which were added to the local mirror
+    by the dependency closure of the installed packages
+
+    :param   sqliteConnection:  SQLite3 connection object
+    """
+
+    sql = 'SELECT name, arch, repo, reason FROM closure_packages ' +\
+          'ORDER BY arch ASC, repo ASC, name ASC;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    print('packages added by the dependency closure: ' + str(len(rows)))
+    for name, arch, repo, reason in rows:
+        print('  ' + arch + '/' + repo + '/' + name + '  (' + reason + ')')
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def is_mirror_open(sqliteConnection, url):
+    """
+    check, whether the circuit breaker of the mirror is open,
+    i.e. the mirror is skipped after too many failures in a row
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  url:                 url of the mirror (or of a file on the mirror)
+    :return
+    """
+
+    sql = "SELECT open_until FROM mirror_health " +\
+          "WHERE host=?;"
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (mirror_host(url),))
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row is None  or  row[0] is None:
+        return False
+    return row[0] > time.time()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def record_mirror_result(sqliteConnection, config, url, success):
+    """
+    update the circuit breaker of the mirror:
+      a success closes it,
+      after  MirrorMaxFailures  failures in a row it is opened for
+      MirrorBackoff  seconds - doubled every time it is opened again
+      (up to one day)
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  config:              dict with the parsed content of the config-file
+    :param  url:                 url of the mirror (or of a file on the mirror)
+    :param  success:             True, if the transfer was successful
+    """
+
+    sql_insert = 'INSERT OR IGNORE INTO mirror_health '                  +\
+                 '(host, failures, num_opens, open_until) VALUES(?,0,0,0);'
+    sql_select = 'SELECT failures, num_opens FROM mirror_health WHERE host=?;'
+    sql_update = 'UPDATE mirror_health '                                 +\
+                 'SET failures=?, num_opens=?, open_until=? WHERE host=?;'
+
+    host = mirror_host(url)
+    if success:
+        sqliteConnection.execute(sql_update, (0, 0, 0, host))
+        sqliteConnection.commit()
+        return
+
+    sqliteConnection.execute(sql_insert, (host,))
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select, (host,))
+    failures, num_opens = cursor.fetchone()
+    cursor.close()
+
+    failures += 1
+    open_until = 0
+    if failures >= config['mirror_max_failures']:
+        num_opens += 1
+        backoff = min(config['mirror_backoff'] * 2 ** (num_opens - 1), 86400)
+        open_until = int(time.time() + backoff)
+        debug_print('Error: too many failures of mirror ' + host +
+                    ', skipping it for ' + str(backoff) + ' seconds')
+
+    sqliteConnection.execute(sql_update, (failures, num_opens, open_until, host))
+    sqliteConnection.commit()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def update_table_mirror_dbs(sqliteConnection, repo, mirror, hash_dbfile):
+    """
+    remember the hash of the repo DB-file last downloaded from the mirror
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  repo:                name of the repository
+    :param  mirror:              url of the mirror (for this repo)
+    :param  hash_dbfile:         hash of the downloaded db-file
+    """
+
+    sql_insert = 'INSERT OR REPLACE INTO mirror_dbs '  +\
+                 '(mirror, repo, hash) VALUES(?,?,?);'
+
+    sqliteConnection.execute(sql_insert, (mirror, repo, hash_dbfile))
+    sqliteConnection.commit()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_package_mirrors(sqliteConnection, repo, mirror):
+    """
+    list the mirrors which carry the package-files of the repo snapshot:
+    the mirror the snapshot came from, followed by the mirrors
+    whose last repo DB-file had the same hash
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  repo:                name of the repository
+    :param  mirror:              url of the mirror the snapshot came from
+    :return:                     list of mirror urls
+    """
+
+    sql = 'SELECT mirror FROM mirror_dbs '                                +\
+          'WHERE repo=? AND mirror<>? AND hash='                          +\
+          '(SELECT hash FROM mirror_dbs WHERE mirror=?) '                 +\
+          'ORDER BY mirror ASC;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (repo, mirror, mirror))
+    mirrors = [mirror] + [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    return mirrors
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def write_signature(sqliteConnection, filename, arch, file_path):
+    """
+    write the signature of the package-file from the  %PGPSIG%  entry
+    of the repo DB  (instead of downloading the .sig - file)
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  filename:            filename of the package
+    :param  arch:                architecture of the repo DB
+    :param  file_path:           path of the package-file
+    :return:                     True, if the signature exists (now)
+    """
+
+    if os.path.exists(file_path + '.sig'):
+        return True
+
+    sql = 'SELECT pgpsig FROM repo_packages '                        +\
+          'WHERE filename=? AND arch=? AND pgpsig IS NOT NULL LIMIT 1;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (filename, arch))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return False
+
+    try:
+        with open(file_path + '.sig', 'wb') as f:
+            f.write(base64.b64decode(row[0]))
+    except:
+        try_unlink(file_path + '.sig')
+        return False
+    return True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def verify_signature(keyring, file_path):
+    """
+    verify the signature of a package-file with  gpgv
+
+    :param  keyring:     keyring with the public keys of the packagers
+    :param  file_path:   path of the package-file
+    :return:             'good', 'bad',
+                         or None if it couldn't be verified (yet),
+                         i.e. missing signature or unknown key
+    """
+
+    if not os.path.exists(file_path + '.sig'):
+        return None
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            ret = subprocess.call(['gpgv', '--keyring', keyring,
+                                   file_path + '.sig', file_path],
+                                  stdout=devnull, stderr=devnull)
+    except OSError:
+        return None
+    # gpgv:  0 good signature,  1 bad signature,  2 other errors
+    if ret == 0:
+        return 'good'
+    if ret == 1:
+        return 'bad'
+    return None
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def verify_signatures(sqliteConnection, config):
+    """
+    verify the signatures of the package-files which weren't verified yet
+    ( SignatureKeyring ,  VerifyWorkers  parallel  gpgv - processes )
+    the result is stored in table  local_mirror , so that every file is
+    verified only once;  package-files with a bad signature are removed
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :return: number of verified package-files
+    """
+
+    keyring = config['signature_keyring']
+    if keyring is None:
+        return 0
+    # (gpgv looks for a keyring without '/' in its home directory)
+    keyring = os.path.abspath(keyring)
+    if not os.path.exists(keyring):
+        debug_print("Error: can't find SignatureKeyring " + keyring)
+        return 0
+
+    sql_select = 'SELECT filename, repo, arch FROM local_mirror '            +\
+                 'WHERE sig_status IS NULL;'
+    sql_update = 'UPDATE local_mirror SET sig_status=? '                     +\
+                 'WHERE filename=? AND arch=?;'
+    sql_delete = 'DELETE FROM local_mirror WHERE filename=? AND arch=?;'
+
+    jobs = queue.Queue()
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select)
+    for filename, repo, arch in cursor:
+        jobs.put((filename, arch, package_path(arch, repo, filename)))
+    cursor.close()
+    if jobs.empty():
+        return 0
+
+    debug_print('verifying signatures of ' + str(jobs.qsize()) +
+                ' package-files')
+
+    results = list()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                filename, arch, file_path = jobs.get_nowait()
+            except queue.Empty:
+                return
+            status = verify_signature(keyring, file_path)
+            with lock:
+                results.append((filename, arch, file_path, status))
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, config['verify_workers']))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    num_verified = 0
+    for filename, arch, file_path, status in results:
+        if status is None:
+            continue
+        num_verified += 1
+        if status == 'bad':
+            debug_print('Error: bad signature, removing ' + filename)
+            sqliteConnection.execute(sql_delete, (filename, arch))
+            try_unlink(file_path)
+            try_unlink(file_path + '.sig')
+        else:
+            sqliteConnection.execute(sql_update, (status, filename, arch))
+    sqliteConnection.commit()
+
+    return num_verified
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def download_package(sqliteConnection, config, repo, arch, s_arch, filename,
+                     mirrors):
+    """
+    download the package-file from the first healthy mirror,
+    on failure retry with the next one
+    (the signature is taken from the repo DB, or downloaded if it isn't there)
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  config:              dict with the parsed content of the config-file
+    :param  repo:                name of the repository
+    :param  arch:                architecture of the repo
+    :param  s_arch:              architecture of the storage ('any' for shared packages)
+    :param  filename:            filename of the package
+    :param  mirrors:             urls of the mirrors carrying the package
+    :return:                     True on success, otherwise False
+    """
+
+    file_path = package_path(s_arch, repo, filename)
+    if os.path.exists(file_path):
+        debug_print('[already exists ] ' + filename, end='\r')
+        write_signature(sqliteConnection, filename, arch, file_path)
+        return True
+
+    for mirror in mirrors:
+        if is_mirror_open(sqliteConnection, mirror):
+            continue
+        url = os.path.join(mirror, filename)
+        success = download(url, file_path)
+        record_mirror_result(sqliteConnection, config, url, success)
+        if success:
+            # the signature from the repo DB saves a request
+            if not write_signature(sqliteConnection, filename, arch, file_path):
+                download(url + '.sig', file_path + '.sig')
+            return True
+
+    debug_print('Error: no mirror could deliver ' + filename)
+    return False
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def remove_unconfigured_archs(sqliteConnection, config):
+    """
+    forget the repo snapshots and remove the package-files of the
+    architectures which aren't configured ( Arch ) (anymore),
+    so that they aren't planned and downloaded
+    (the installed packages of the clients are kept)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :return: number of removed package-files
+    """
+
+    archs = config['archs'] + ['any']
+    not_in_archs = 'arch NOT IN (' + ','.join(['?'] * len(archs)) + ')'
+
+    sql_repo   = 'DELETE FROM repo_packages WHERE ' + not_in_archs + ';'
+    sql_select = 'SELECT filename, repo, arch FROM local_mirror WHERE ' + \
+                 not_in_archs + ';'
+    sql_delete = 'DELETE FROM local_mirror WHERE filename=? AND arch=?;'
+
+    sqliteConnection.execute(sql_repo, archs)
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select, archs)
+    remove_list = cursor.fetchall()
+    cursor.close()
+
+    for filename, repo, arch in remove_list:
+        debug_print(' removing package ' + filename + ' (' + arch +
+                    ' not configured)')
+        file_path = package_path(arch, repo, filename)
+        try_unlink(file_path)
+        try_unlink(file_path + '.sig')
+    sqliteConnection.executemany(sql_delete,
+                                 [(row[0], row[2]) for row in remove_list])
+    sqliteConnection.commit()
+    return len(remove_list)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+@log_indented
+def update_localmirror(sqliteConnection, repo_list, config):
+    """
+    update the local mirror:
+      for every architecture and repo and every mirror for this repo:
+        read the repo DB-file (if it's unknown) into table  repo_packages
+      resolve the dependency closure of the installed packages
+      download newer versions of the wanted packages and update DB
+      (mirrors with too many failures in a row are skipped for a while,
+      architecture independent packages are downloaded only once)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   repo_list:         list of (arch, repo)
+    :param   config:            dict with the parsed content of the config-file
+    :return:
+    """
+
+    debug_print('updating local mirror')
+
+    remove_unconfigured_archs(sqliteConnection, config)
+
+    for arch, repo in repo_list:
+        for mirror in config[(arch, repo)]:
+            url = mirror.replace('$repo', repo).replace('$arch', arch)
+            if is_mirror_open(sqliteConnection, url):
+                debug_print('skipping mirror ' + mirror_host(url) +
+                            ' (too many failures)')
+                continue
+
+            start_time = time.time()
+            file_path, hash_dbfile = download_db(sqliteConnection, mirror,
+                                                 repo, arch, config)
+            add_phase_stats('db_probe', start_time, 1)
+
+            if hash_dbfile is None:
+                continue
+            update_table_mirror_dbs(sqliteConnection, repo, url, hash_dbfile)
+            if is_hash_known(sqliteConnection, hash_dbfile)  and \
+               is_repo_known(sqliteConnection, repo, arch):
+                debug_print('skipping repo DB-file (known hash of database)')
+                try_unlink(file_path)
+                continue
+            add_hash(sqliteConnection, hash_dbfile)
+
+            start_time = time.time()
+            num_packages = update_table_repo_packages(
+                                sqliteConnection, repo, arch, url,
+                                iter_repo_content(file_path))
+            try_unlink(file_path)
+            add_phase_stats('db_parse', start_time, num_packages)
+
+    download_wanted_packages(sqliteConnection, config)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def download_wanted_packages(sqliteConnection, config):
+    """
+    resolve the dependency closure of the installed packages and
+    download newer versions of the wanted packages (of the stored repo
+    snapshots) and update DB
+    (from the upstream pacyard if configured and it has them, otherwise from
+    the mirrors;  architecture independent packages are downloaded only once)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :return: number of downloaded package-files
+    """
+
+    start_time = time.time()
+    update_closure(sqliteConnection)
+    plan = get_download_plan(sqliteConnection)
+    add_phase_stats('plan', start_time, len(plan))
+
+    # the  NumVersionsToKeep  newest versions of every package
+    # (the plan lists the newest version first)
+    selected = list()
+    num_selected = dict()
+    selected_files = set()
+    shared_sha256 = dict()
+    for entry in plan:
+        filename, name, repo, arch, builddate = entry[:5]
+        sha256 = entry[7]
+        s_arch = shared_storage_arch(sqliteConnection, filename, arch, sha256)
+        # 'any' package selected for another architecture:  shared if it's
+        # the same file, otherwise stored for this architecture
+        if s_arch == 'any'  and  filename in shared_sha256:
+            if shared_sha256[filename] is None  or  sha256 is None  or \
+               shared_sha256[filename] == sha256:
+                continue
+            s_arch = arch
+        if (filename, s_arch) in selected_files:
+            continue
+        num = get_num_of_new_packages(sqliteConnection,
+                                      name, arch, builddate) + \
+              num_selected.get((name, arch), 0)
+        if num >= config['num_versions_to_keep']:
+            debug_print(' [version too old] ' + filename, end='\r')
+            continue
+        num_selected[(name, arch)] = num_selected.get((name, arch), 0) + 1
+        selected_files.add((filename, s_arch))
+        if s_arch == 'any':
+            shared_sha256[filename] = sha256
+        selected.append(entry + (s_arch,))
+
+    start_time = time.time()
+    from_upstream = download_from_upstream(sqliteConnection, config, selected)
+
+    num_downloads = 0
+    for filename, name, repo, arch, builddate, mirror, csize, sha256, \
+        s_arch in selected:
+        debug_print(' ', end='\r')
+        if (filename, s_arch) not in from_upstream:
+            mirrors = get_package_mirrors(sqliteConnection, repo, mirror)
+            if not download_package(sqliteConnection, config,
+                                    repo, arch, s_arch, filename, mirrors):
+                continue
+        update_table_localmirror(sqliteConnection, name, filename, repo,
+                                 s_arch, builddate, sha256)
+        num_downloads += 1
+    add_phase_stats('download', start_time, num_downloads)
+    return num_downloads
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def write_manifest(sqliteConnection, repo_list):
+    """
+    write the manifest of the local mirror  pacyard_manifest.json
+    (path, size and SHA-256 of every package-file), read by the pacyards
+    using this one as upstream  (see  download_from_upstream() )
+    the paths point into the published snapshot  <arch>/<repo>/<filename>
+    (an architecture independent package-file under the first architecture
+     with its repo sharing it), never into the pool
+    a package-file stored per architecture is listed as  <arch>/<filename>
+    ( size  is the one of the package-file alone, not the one with its
+      signature kept in  local_mirror  for the disk quota)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   repo_list:         list of (arch, repo)
+    :return:
+    """
+
+    debug_print('writing manifest of the local mirror')
+
+    sql_fill   = 'UPDATE local_mirror SET sha256='                        +\
+                 '(SELECT sha256 FROM repo_packages p '                   +\
+                 'WHERE p.filename=local_mirror.filename '                +\
+                 "AND (p.arch=local_mirror.arch OR local_mirror.arch='any') " +\
+                 'LIMIT 1) WHERE sha256 IS NULL;'
+    sql_select = 'SELECT filename, repo, arch, sha256 FROM local_mirror;'
+
+    sqliteConnection.execute(sql_fill)
+    sqliteConnection.commit()
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    # architectures not sharing an architecture independent package-file
+    per_arch = set([(filename, arch) for filename, repo, arch, sha256
+                    in rows if arch != 'any'])
+
+    files = dict()
+    for filename, repo, arch, sha256 in rows:
+        try:
+            size = os.path.getsize(package_path(arch, repo, filename))
+        except OSError:
+            continue
+        key = filename
+        if arch == 'any':
+            archs = [a for a, r in sorted(repo_list)
+                     if r == repo  and  (filename, a) not in per_arch]
+            if not archs:
+                continue
+            arch = archs[0]
+        elif storage_arch(filename, arch) == 'any':
+            key = arch + '/' + filename
+        files[key] = ['/'.join((arch, repo, filename)), size, sha256]
+
+    try:
+        with open('pacyard_manifest.json.part', 'w') as f:
+            json.dump({ 'time': int(time.time()), 'files': files }, f)
+        try_unlink('pacyard_manifest.json')
+        os.rename('pacyard_manifest.json.part', 'pacyard_manifest.json')
+    except:
+        debug_print("Error: Can't write pacyard_manifest.json")
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_upstream_manifest(sqliteConnection, config):
+    """
+    read the manifest of the upstream pacyard
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :return: dict  filename -> [path, size, sha256]
+    """
+
+    url = config['upstream'] + '/pacyard_manifest.json'
+    start_time = time.time()
+    try:
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        manifest = response.json()['files']
+    except:
+        add_mirror_stats(url, 0, start_time, error=True)
+        record_mirror_result(sqliteConnection, config, url, False)
+        debug_print("Error: can't read manifest of upstream " + url)
+        return dict()
+    add_mirror_stats(url, len(response.content), start_time)
+    record_mirror_result(sqliteConnection, config, url, True)
+    return manifest
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def fetch_verified(session, url, file_path, size, sha256):
+    """
+    download a file and verify its size and SHA-256
+    (a file which doesn't match is deleted)
+
+    :param  session:     requests.Session
+    :param  url:         url of the file
+    :param  file_path:   path of the local file
+    :param  size:        expected size (or None)
+    :param  sha256:      expected SHA-256 (or None)
+    :return:             (True on success, otherwise False,  transferred bytes)
+    """
+
+    num_bytes = 0
+    digest = hashlib.sha256()
+    try:
+        response = session.get(url, stream=True, timeout=60)
+        response.raise_for_status()
+        with open(file_path + '.part', 'wb') as f:
+            for chunk in response.iter_content(1048576):
+                f.write(chunk)
+                digest.update(chunk)
+                num_bytes += len(chunk)
+    except:
+        try_unlink(file_path + '.part')
+        return False, num_bytes
+
+    if (size is not None  and  num_bytes != size)  or \
+       (sha256 is not None  and  digest.hexdigest() != sha256):
+        debug_print('Error: checksum mismatch ' + url)
+        try_unlink(file_path + '.part')
+        return False, num_bytes
+
+    try:
+        os.rename(file_path + '.part', file_path)
+    except:
+        try_unlink(file_path + '.part')
+        return False, num_bytes
+    return True, num_bytes
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def download_from_upstream(sqliteConnection, config, selected):
+    """
+    download the selected package-files which the
+    upstream pacyard has (see its manifest), with  UpstreamWorkers
+    parallel transfers;  every file is verified against size and SHA-256
+    of the own repo snapshot  (or of the manifest, if the repo DB has none)
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :param   selected:          list of (filename, name, repo, arch, builddate,
+                                mirror, csize, sha256, s_arch)  to download
+                                ( s_arch : architecture of the storage)
+    :return: set of the (filename, s_arch) downloaded from the upstream pacyard
+    """
+
+    upstream = config['upstream']
+    if upstream is None  or  not selected  or \
+       is_mirror_open(sqliteConnection, upstream):
+        return set()
+
+    manifest = get_upstream_manifest(sqliteConnection, config)
+    jobs = queue.Queue()
+    num_jobs = 0
+    for filename, name, repo, arch, builddate, mirror, csize, sha256, \
+        s_arch in selected:
+        file_path = package_path(s_arch, repo, filename)
+        # stored per architecture upstream, if it differs from the shared one
+        entry = manifest.get(arch + '/' + filename, manifest.get(filename))
+        if entry is None  or  os.path.exists(file_path):
+            continue
+        path, size, upstream_sha256 = entry
+        jobs.put((upstream + '/' + path, file_path, filename, arch, s_arch,
+                  csize if csize is not None else size,
+                  sha256 if sha256 is not None else upstream_sha256))
+        num_jobs += 1
+    if not num_jobs:
+        return set()
+
+    debug_print('downloading ' + str(num_jobs) + ' of ' + str(len(selected)) +
+                ' package-files from upstream ' + upstream)
+
+    results = list()
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            try:
+                url, file_path, filename, arch, s_arch, size, sha256 = \
+                    jobs.get_nowait()
+            except queue.Empty:
+                return
+            start_time = time.time()
+            success, num_bytes = fetch_verified(session, url, file_path,
+                                                size, sha256)
+            with lock:
+                add_mirror_stats(url, num_bytes, start_time, error=not success)
+                results.append((url, file_path, filename, arch, s_arch,
+                                success))
+                debug_print(os.path.basename(file_path), end='\r')
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(config['upstream_workers'], num_jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    downloaded = set()
+    for url, file_path, filename, arch, s_arch, success in results:
+        record_mirror_result(sqliteConnection, config, url, success)
+        if success:
+            if not write_signature(sqliteConnection, filename, arch, file_path):
+                download(url + '.sig', file_path + '.sig')
+            downloaded.add((filename, s_arch))
+    debug_print(str(len(downloaded)) + ' package-files from upstream')
+    return downloaded
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def link_file(src, dst):
+    """
+    link a file of the pool into a snapshot
+    (as hardlink, or as copy if the filesystem doesn't support hardlinks:
+     a symlink would break when the file is removed from the pool while
+     the snapshot is still published)
+
+    :param  src:   path of the file
+    :param  dst:   path of the link
+    :return:       True on success, otherwise False
+    """
+
+    try:
+        os.link(src, dst)
+    except:
+        try:
+            shutil.copy2(src, dst)
+        except:
+            try_unlink(dst)
+            debug_print("Error: can't link " + dst)
+            return False
+    return True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def publish_snapshot(sqliteConnection, repo_list, snapshot_grace=3600):
+    """
+    publish the state of the local mirror atomically:
+    all package-files of the DB are linked from the pool into the new
+    snapshot  snapshots/<id>/<arch>/<repo>/  (the architecture independent
+    ones into the dirs of all architectures whose repo has the same file,
+    see  shared_storage_arch() ), then the symlink  current
+    is switched to it with a single rename
+    the clients read  <arch>/ , a symlink to  current/<arch> , so they
+    never see a half-updated repo or a file still being written
+
+    the previous snapshots are removed  snapshot_grace  seconds after they
+    were replaced (downloads still running from them can finish),
+    packages evicted from the pool disappear for the clients only with the
+    next publish
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   repo_list:         list of (arch, repo)
+    :param   snapshot_grace:    seconds a replaced snapshot is kept
+    :return: id of the published snapshot
+    """
+
+    debug_print('publishing snapshot of the local mirror')
+
+    # the id is the time of the publish [ms]  (see  prune_snapshots() )
+    snapshot_id = int(time.time() * 1000)
+    while os.path.exists(os.path.join(SNAPSHOT_DIR, str(snapshot_id))):
+        snapshot_id += 1
+    snapshot = os.path.join(SNAPSHOT_DIR, str(snapshot_id))
+    os.makedirs(snapshot)
+
+    archs_of_repo = dict()
+    for arch, repo in repo_list:
+        archs_of_repo.setdefault(repo, set()).add(arch)
+        os.makedirs(os.path.join(snapshot, arch, repo))
+
+    # the package-files stored per architecture first, they take precedence
+    # over the shared ones
+    sql = "SELECT filename, repo, arch FROM local_mirror ORDER BY arch='any';"
+    sql_differ = 'SELECT p.filename, p.arch FROM repo_packages p '           +\
+                 'JOIN local_mirror m '                                     +\
+                 "ON m.filename=p.filename AND m.arch='any' "               +\
+                 'WHERE p.sha256!=m.sha256;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_differ)
+    differ = set(cursor.fetchall())
+    cursor.execute(sql)
+    num_files = 0
+    for filename, repo, arch in cursor:
+        if arch == 'any':
+            archs = [t_arch for t_arch in archs_of_repo.get(repo, ())
+                     if (filename, t_arch) not in differ]
+        else:
+            archs = (arch,)
+        for name in (filename, filename + '.sig'):
+            src = package_path(arch, repo, name)
+            if not os.path.exists(src):
+                continue
+            for t_arch in archs:
+                dst_dir = os.path.join(snapshot, t_arch, repo)
+                if not os.path.exists(dst_dir):
+                    os.makedirs(dst_dir)
+                if not os.path.lexists(os.path.join(dst_dir, name)):
+                    link_file(src, os.path.join(dst_dir, name))
+        num_files += 1
+    cursor.close()
+
+    # atomic switch:  rename() replaces the old symlink
+    tmp_link = CURRENT_LINK + '.new'
+    try_unlink(tmp_link)
+    os.symlink(snapshot, tmp_link)
+    os.rename(tmp_link, CURRENT_LINK)
+
+    for arch in sorted(set([arch for arch, repo in repo_list])):
+        if os.path.islink(arch):
+            continue
+        if os.path.exists(arch):
+            debug_print("Error: can't publish " + arch + ' (not a symlink)')
+            continue
+        os.symlink(os.path.join(CURRENT_LINK, arch), arch)
+
+    debug_print('published snapshot ' + str(snapshot_id) + ' (' +
+                str(num_files) + ' package-files)')
+    prune_snapshots(snapshot_id, snapshot_grace)
+    return snapshot_id
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def prune_snapshots(current_id, snapshot_grace):
+    """
+    remove the snapshots which were replaced more than  snapshot_grace
+    seconds ago (a snapshot is replaced when its successor is published,
+    the id of a snapshot is the time of its publish [ms])
+    and the unpublished ones (of an interrupted publish)
+
+    :param  current_id:      id of the published snapshot
+    :param  snapshot_grace:  seconds a replaced snapshot is kept
+    """
+
+    ids = sorted([int(name) for name in os.listdir(SNAPSHOT_DIR)
+                  if name.isdigit()])
+    limit = (time.time() - snapshot_grace) * 1000
+
+    for snapshot_id, successor_id in zip(ids, ids[1:] + [None]):
+        if snapshot_id == current_id:
+            continue
+        if snapshot_id < current_id  and  successor_id > limit:
+            continue
+        debug_print('removing snapshot ' + str(snapshot_id))
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, str(snapshot_id)),
+                      ignore_errors=True)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def move_file(src, dst):
+    """
+    move a file (also across filesystems)
+
+    :param  src:   path of the file
+    :param  dst:   new path
+    :return:       True on success, otherwise False
+    """
+
+    try:
+        shutil.move(src, dst)
+    except:
+        debug_print("Error: can't move " + src + ' to ' + dst)
+        return False
+    return True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def check_uploaded_signature(sqliteConnection, config, file_path, filename,
+                             arch, dst):
+    """
+    copy an uploaded signature to  dst  (next to the package-file),
+    if it's byte-identical to the  %PGPSIG%  of the repo DB,
+    or if  gpgv  verifies it with  SignatureKeyring
+    (otherwise it's rejected)
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  config:              dict with the parsed content of the config-file
+    :param  file_path:           path of the uploaded signature
+    :param  filename:            filename of the package
+    :param  arch:                architecture of the storage ('any' for shared packages)
+    :param  dst:                 path of the signature in the pool
+    :return:                     True, if it was accepted
+    """
+
+    # the  %PGPSIG%  of the repos whose package-file is the stored one
+    sql = 'SELECT p.pgpsig FROM repo_packages p JOIN local_mirror m '         +\
+          'ON m.filename=p.filename WHERE m.filename=? AND m.arch=? '        +\
+          "AND (p.arch=m.arch OR (m.arch='any' AND (m.sha256 IS NULL "       +\
+          'OR p.sha256=m.sha256))) AND p.pgpsig IS NOT NULL;'
+
+    try:
+        with open(file_path, 'rb') as f:
+            signature = f.read()
+    except:
+        return False
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql, (filename, arch))
+    pgpsigs = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    identical = False
+    for pgpsig in pgpsigs:
+        try:
+            identical = identical  or  base64.b64decode(pgpsig) == signature
+        except:
+            continue
+
+    keyring = config['signature_keyring']
+    if identical  or  keyring:
+        try:
+            shutil.copy(file_path, dst)
+        except:
+            try_unlink(dst)
+            return False
+        if identical  or  verify_signature(keyring, dst[:-4]) == 'good':
+            return True
+        try_unlink(dst)
+
+    debug_print(' rejecting ' + filename + '.sig (not verified)')
+    return False
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+@log_indented
+def import_uploads(sqliteConnection, config):
+    """
+    accept the package-files uploaded by the clients into the sub-dir  upload
+    (packages they had to download from the internet, see  pacman_xfer.py ):
+    a file is moved into the local mirror if its name, size and SHA-256
+    match a wanted package of the current repo snapshots (of any
+    architecture), otherwise it is deleted
+    ( files still being uploaded have to end with  .part )
+    an uploaded signature is accepted only if it's the one of the repo DB
+    ( %PGPSIG% ) or  gpgv  verifies it (with  SignatureKeyring ),
+    see  check_uploaded_signature()
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :return: number of accepted package-files
+    """
+
+    sql_select  = 'SELECT name, repo, arch, builddate, csize, sha256 '      +\
+                  'FROM repo_packages p WHERE filename=? '                  +\
+                  'AND (EXISTS (SELECT 1 FROM installed_packages i '        +\
+                  'WHERE i.name=p.name AND i.arch=p.arch) '                 +\
+                  'OR EXISTS (SELECT 1 FROM closure_packages c '            +\
+                  'WHERE c.name=p.name AND c.arch=p.arch));'
+    sql_unevict = 'DELETE FROM evicted_packages WHERE name=? AND arch=?;'
+
+    file_path_list = sorted(glob.glob(os.path.join('upload', '*.pkg.tar.*')))
+    if not file_path_list:
+        return 0
+    debug_print('importing uploaded package-files')
+
+    num_accepted = 0
+    cursor = sqliteConnection.cursor()
+    for file_path in file_path_list:
+        filename = os.path.basename(file_path)
+        if filename.endswith('.part')  or  filename.endswith('.sig'):
+            continue
+
+        # an architecture independent package may differ per architecture
+        cursor.execute(sql_select, (filename,))
+        rows = cursor.fetchall()
+        reason = None
+        if not rows:
+            reason = 'not a wanted package of the repo DB'
+        else:
+            size = os.path.getsize(file_path)
+            rows = [row for row in rows if row[4] is not None  and  row[4] == size]
+            if not rows:
+                reason = 'size mismatch'
+        if reason is None:
+            sha256 = hash_file(file_path)
+            rows = [row for row in rows if row[5] is not None  and  row[5] == sha256]
+            if not rows:
+                reason = 'SHA-256 mismatch'
+        if reason is None:
+            name, repo, arch, builddate = rows[0][:4]
+            s_arch = shared_storage_arch(sqliteConnection, filename, arch, sha256)
+            if is_in_localmirror(sqliteConnection, filename, s_arch):
+                reason = 'already in local mirror'
+
+        if reason is not None:
+            debug_print(' rejecting ' + filename + ' (' + reason + ')')
+            try_unlink(file_path)
+            continue
+
+        dst = package_path(s_arch, repo, filename)
+        if not os.path.exists(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if not move_file(file_path, dst):
+            continue
+        if write_signature(sqliteConnection, filename, arch, dst):
+            try_unlink(file_path + '.sig')
+        debug_print(' accepting ' + filename)
+        update_table_localmirror(sqliteConnection, name, filename, repo,
+                                 s_arch, builddate, sha256)
+        sqliteConnection.execute(sql_unevict, (name, s_arch))
+        num_accepted += 1
+
+    # signatures: copy them next to their package-file(s) if they are valid,
+    # delete them if it's not in the local mirror (after a day)
+    sql_repo = 'SELECT repo, arch FROM local_mirror WHERE filename=?;'
+    for file_path in glob.glob(os.path.join('upload', '*.pkg.tar.*.sig')):
+        filename = os.path.basename(file_path)[:-4]
+        cursor.execute(sql_repo, (filename,))
+        rows = cursor.fetchall()
+        if not rows:
+            if os.path.getmtime(file_path) < time.time() - 24 * 3600:
+                try_unlink(file_path)
+            continue
+        for repo, arch in rows:
+            dst = package_path(arch, repo, filename) + '.sig'
+            if not os.path.exists(dst)  and \
+               check_uploaded_signature(sqliteConnection, config, file_path,
+                                        filename, arch, dst):
+                debug_print(' accepting ' + filename + '.sig')
+        try_unlink(file_path)
+    # incomplete uploads
+    for file_path in glob.glob(os.path.join('upload', '*.part')):
+        if os.path.getmtime(file_path) < time.time() - 24 * 3600:
+            try_unlink(file_path)
+    cursor.close()
+    sqliteConnection.commit()
+    return num_accepted
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def package_name(filename):
+    """
+    carve the name of the package from its filename
+    ( <name>-<pkgver>-<pkgrel>-<arch>.pkg.tar.<ext> )
+
+    :param  filename:  filename of the package
+    :return:           name of the package
+    """
+
+    parts = filename.rsplit('-', 3)
+    if len(parts) == 4:
+        return parts[0]
+    return filename
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def add_xfer_event(sqliteConnection, event):
+    """
+    add a hit/miss event of a client to the per-package, per-host
+    and per-repo statistics in table  xfer_stats
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  event:               dict with the event, logged by  pacman_xfer.py
+                                 (time, host, repo, file, size, source, duration)
+                                 (failed downloads are skipped, they are
+                                  neither hits nor misses)
+    """
+
+    sql_insert = 'INSERT OR IGNORE INTO xfer_stats (kind, key) VALUES(?,?);'
+    sql_update = 'UPDATE xfer_stats SET '                                   +\
+                 'hits = hits + ?, misses = misses + ?, '                   +\
+                 'hit_bytes = hit_bytes + ?, miss_bytes = miss_bytes + ?, ' +\
+                 'hit_seconds = hit_seconds + ?, '                          +\
+                 'miss_seconds = miss_seconds + ?, '                        +\
+                 'last_access = MAX(last_access, ?) '                       +\
+                 'WHERE kind=? AND key=?;'
+
+    if event.get('source') == 'failed':
+        return
+    hit = event.get('source') == 'mirror'
+    size = int(event.get('size') or 0)
+    duration = float(event.get('duration') or 0)
+    if hit:
+        values = (1, 0, size, 0, duration, 0)
+    else:
+        values = (0, 1, 0, size, 0, duration)
+    values += (int(event.get('time') or 0),)
+
+    for kind, key in (('package', package_name(event['file'])),
+                      ('host',    event.get('host') or 'unknown'),
+                      ('repo',    event.get('repo') or 'unknown')):
+        sqliteConnection.execute(sql_insert, (kind, key))
+        sqliteConnection.execute(sql_update, values + (kind, key))
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def import_xfer_logs(sqliteConnection):
+    """
+    import the hit/miss events of the clients,
+    contained in the files   xferlog_<HOSTNAME>.log   (written by pacman_xfer.py)
+    and delete the files
+    ( events which aren't newer than the last imported event of their host
+      are skipped, a log copied again with all its old events isn't
+      counted twice )
+
+    :param   sqliteConnection:  SQLite3 connection object
+    """
+
+    debug_print('importing transfer logs of the clients')
+
+    sql_select = 'SELECT host, last_time FROM xfer_hosts;'
+    sql_update = 'INSERT OR REPLACE INTO xfer_hosts (host, last_time) VALUES(?,?);'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select)
+    last_time = dict(cursor.fetchall())
+    cursor.close()
+    new_last_time = dict(last_time)
+
+    for log_file in glob.glob('xferlog_*.log'):
+        debug_print('  ' + log_file)
+
+        # move the file away first, so that events appended by a client
+        # in the meantime don't get lost
+        tmp_file = os.path.join('tmp', log_file)
+        try:
+            os.rename(log_file, tmp_file)
+        except:
+            debug_print("Error: Can't move " + log_file)
+            continue
+
+        num_skipped = 0
+        with open(tmp_file, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                    host = event.get('host') or 'unknown'
+                    event_time = float(event.get('time') or 0)
+                    if event_time <= last_time.get(host, -1):
+                        num_skipped += 1
+                        continue
+                    add_xfer_event(sqliteConnection, event)
+                    new_last_time[host] = max(new_last_time.get(host, 0),
+                                              event_time)
+                except:
+                    debug_print('Error: invalid entry in ' + log_file)
+        if num_skipped:
+            debug_print('  skipped ' + str(num_skipped) +
+                        ' events already imported')
+
+        sqliteConnection.executemany(sql_update, list(new_last_time.items()))
+        sqliteConnection.commit()
+        try_unlink(tmp_file)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def prom_label(value):
+    """
+    escape a value for use as label in the Prometheus text format
+
+    :param  value:  label value
+    :return:        escaped label value
+    """
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def export_prometheus_textfile(sqliteConnection, config, num_top_missed=20):
+    """
+    write the cache statistics (hit ratio, WAN bytes saved,
+    packages most often missed) into a textfile for the
+    textfile collector of the Prometheus node exporter
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   config:            dict with the parsed content of the config-file
+    :param   num_top_missed:    number of most often missed packages to export
+    """
+
+    file_path = config['prometheus_textfile']
+    if not file_path:
+        return
+
+    debug_print('writing Prometheus textfile ' + file_path)
+
+    sql_select = 'SELECT key, hits, misses, hit_bytes, miss_bytes, '  +\
+                 'hit_seconds, miss_seconds '                         +\
+                 'FROM xfer_stats WHERE kind=? ORDER BY key ASC;'
+    sql_missed = 'SELECT key, misses, miss_bytes FROM xfer_stats '    +\
+                 "WHERE kind='package' AND misses > 0 "               +\
+                 'ORDER BY misses DESC, miss_bytes DESC LIMIT ?;'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_select, ('repo',))
+    repo_rows = cursor.fetchall()
+    cursor.execute(sql_select, ('host',))
+    host_rows = cursor.fetchall()
+    cursor.execute(sql_missed, (num_top_missed,))
+    missed_rows = cursor.fetchall()
+    cursor.close()
+
+    hits = sum([row[1] for row in repo_rows])
+    misses = sum([row[2] for row in repo_rows])
+    hit_bytes = sum([row[3] for row in repo_rows])
+    ratio = float(hits) / (hits + misses) if hits + misses else 0.0
+
+    lines = list()
+    lines.append('# HELP pacyard_cache_hit_ratio Share of package downloads served by the local mirror.')
+    lines.append('# TYPE pacyard_cache_hit_ratio gauge')
+    lines.append('pacyard_cache_hit_ratio %f' % ratio)
+    lines.append('# HELP pacyard_wan_bytes_saved_total Bytes served by the local mirror instead of the internet.')
+    lines.append('# TYPE pacyard_wan_bytes_saved_total counter')
+    lines.append('pacyard_wan_bytes_saved_total %d' % hit_bytes)
+
+    for kind, rows in (('repo', repo_rows), ('host', host_rows)):
+        lines.append('# HELP pacyard_%s_requests_total Package downloads of the clients per %s.' % (kind, kind))
+        lines.append('# TYPE pacyard_%s_requests_total counter' % kind)
+        for row in rows:
+            label = '%s="%s"' % (kind, prom_label(row[0]))
+            lines.append('pacyard_%s_requests_total{%s,result="hit"} %d'  % (kind, label, row[1]))
+            lines.append('pacyard_%s_requests_total{%s,result="miss"} %d' % (kind, label, row[2]))
+        lines.append('# HELP pacyard_%s_bytes_total Bytes downloaded by the clients per %s.' % (kind, kind))
+        lines.append('# TYPE pacyard_%s_bytes_total counter' % kind)
+        for row in rows:
+            label = '%s="%s"' % (kind, prom_label(row[0]))
+            lines.append('pacyard_%s_bytes_total{%s,result="hit"} %d'  % (kind, label, row[3]))
+            lines.append('pacyard_%s_bytes_total{%s,result="miss"} %d' % (kind, label, row[4]))
+        lines.append('# HELP pacyard_%s_transfer_seconds_total Download time of the clients per %s.' % (kind, kind))
+        lines.append('# TYPE pacyard_%s_transfer_seconds_total counter' % kind)
+        for row in rows:
+            label = '%s="%s"' % (kind, prom_label(row[0]))
+            lines.append('pacyard_%s_transfer_seconds_total{%s,result="hit"} %f'  % (kind, label, row[5]))
+            lines.append('pacyard_%s_transfer_seconds_total{%s,result="miss"} %f' % (kind, label, row[6]))
+
+    lines.append('# HELP pacyard_package_misses_total Downloads from the internet of the most often missed packages.')
+    lines.append('# TYPE pacyard_package_misses_total counter')
+    for row in missed_rows:
+        lines.append('pacyard_package_misses_total{package="%s"} %d' % (prom_label(row[0]), row[1]))
+
+    # write to a temporary file first, so that the collector never reads
+    # a half-written file
+    tmp_path = file_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp_path, file_path)
+    except:
+        debug_print("Error: Can't write " + file_path)
+        try_unlink(tmp_path)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def save_run_stats(sqliteConnection, start_time):
+    """
+    store the statistics of the current run
+    in the tables  runs , run_phases  and  run_mirrors
+    and delete the statistics of runs older than 60 days
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   start_time:        start time of the run  (time.time())
+    """
+
+    debug_print('storing statistics of the run')
+
+    sql_runs    = 'INSERT INTO runs (start_time, duration) VALUES(?,?);'
+    sql_phases  = 'INSERT INTO run_phases '                              +\
+                  '(run_id, phase, seconds, count) VALUES(?,?,?,?);'
+    sql_mirrors = 'INSERT INTO run_mirrors '                             +\
+                  '(run_id, mirror, bytes, requests, errors, seconds) '  +\
+                  'VALUES(?,?,?,?,?,?);'
+
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_runs, (int(start_time), time.time() - start_time))
+    run_id = cursor.lastrowid
+    cursor.close()
+
+    for phase, (seconds, count) in run_stats['phases'].items():
+        sqliteConnection.execute(sql_phases, (run_id, phase, seconds, count))
+    for mirror, (num_bytes, requests, errors, seconds) in \
+                                             run_stats['mirrors'].items():
+        sqliteConnection.execute(sql_mirrors, (run_id, mirror, num_bytes,
+                                               requests, errors, seconds))
+
+    limit = str(int(time.time()) - 60 * 24 * 3600)
+    for table in ('run_phases', 'run_mirrors'):
+        sqliteConnection.execute('DELETE FROM ' + table + ' WHERE run_id IN ' +\
+                                 '(SELECT run_id FROM runs '                   +\
+                                 'WHERE start_time < ' + limit + ');')
+    sqliteConnection.execute('DELETE FROM runs WHERE start_time < ' + limit + ';')
+    sqliteConnection.commit()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def get_run_stats(sqliteConnection, num_runs):
+    """
+    read the statistics of the last  num_runs  runs
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   num_runs:          number of runs
+    :return: list of dicts (newest run first) with the keys
+             run_id, start_time, duration, phases, mirrors
+    """
+
+    sql_runs    = 'SELECT run_id, start_time, duration FROM runs ' +\
+                  'ORDER BY run_id DESC LIMIT ?;'
+    sql_phases  = 'SELECT phase, seconds, count FROM run_phases '  +\
+                  'WHERE run_id=?;'
+    sql_mirrors = 'SELECT mirror, bytes, requests, errors, seconds ' +\
+                  'FROM run_mirrors WHERE run_id=?;'
+
+    runs = list()
+    cursor = sqliteConnection.cursor()
+    cursor.execute(sql_runs, (num_runs,))
+    for run_id, start_time, duration in cursor.fetchall():
+        run = { 'run_id': run_id,
+                'start_time': start_time,
+                'duration': duration,
+                'phases': dict(),
+                'mirrors': dict() }
+        cursor.execute(sql_phases, (run_id,))
+        for phase, seconds, count in cursor.fetchall():
+            run['phases'][phase] = { 'seconds': seconds, 'count': count }
+        cursor.execute(sql_mirrors, (run_id,))
+        for mirror, num_bytes, requests, errors, seconds in cursor.fetchall():
+            run['mirrors'][mirror] = { 'bytes': num_bytes,
+                                       'requests': requests,
+                                       'errors': errors,
+                                       'seconds': seconds }
+        runs.append(run)
+    cursor.close()
+
+    return runs
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def print_run_stats(sqliteConnection, num_runs, as_json=False):
+    """
+    print the per-phase timing of the last  num_runs  runs
+    and the throughput per mirror
+
+    :param   sqliteConnection:  SQLite3 connection object
+    :param   num_runs:          number of runs
+    :param   as_json:           print machine-readable JSON instead of tables
+    """
+
+    runs = get_run_stats(sqliteConnection, num_runs)
+    if as_json:
+        print(json.dumps(runs, indent=2, sort_keys=True))
+        return
+
+    phases = ('cleanup', 'config', 'db_probe', 'db_parse',
+              'plan', 'download', 'retention')
+
+    print('%-16s %8s' % ('run', 'total') +
+          ''.join([' %9s' % phase for phase in phases]))
+    for run in runs:
+        start = datetime.datetime.fromtimestamp(run['start_time'])
+        print('%-16s %7.1fs' % (start.strftime('%Y-%m-%d %H:%M'),
+                                run['duration']) +
+              ''.join([' %8.1fs' % run['phases'].get(phase,
+                                                     {'seconds': 0})['seconds']
+                       for phase in phases]))
+
+    mirrors = dict()
+    for run in runs:
+        for mirror, values in run['mirrors'].items():
+            totals = mirrors.setdefault(mirror, [0, 0, 0, 0.0])
+            totals[0] += values['bytes']
+            totals[1] += values['requests']
+            totals[2] += values['errors']
+            totals[3] += values['seconds']
+
+    print('')
+    print('%-40s %10s %8s %7s %10s' % ('mirror', 'MB', 'requests',
+                                      'errors', 'kB/s'))
+    for mirror in sorted(mirrors.keys()):
+        num_bytes, requests, errors, seconds = mirrors[mirror]
+        throughput = num_bytes / seconds / 1024 if seconds else 0.0
+        print('%-40s %10.1f %8d %7d %10.1f' % (mirror, num_bytes / 1048576.0,
+                                              requests, errors, throughput))
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def sync_localmirror(sqliteConnection, config_file):
+    """
+    one complete run:  apply the changes of the installed packages,
+    clean up, update the local mirror, apply the retention,
+    publish the new state, import the xfer-logs and store the statistics
+
+    :param sqliteConnection:  SQLite3 connection object
+    :param config_file:       configuration-file
+    :return:
+    """
+
+    run_start_time = start_time = time.time()
+    apply_package_diffs(sqliteConnection,
+                        read_config(list(), config_file)['archs'])
+    num_removed = cleanup_table_localmirror(sqliteConnection)
+    add_phase_stats('cleanup', start_time, num_removed)
+
+    start_time = time.time()
+    config = read_config(get_repo_list(sqliteConnection), config_file)
+    repo_list = config['repo_list']
+    set_memory_limit(sqliteConnection, config)
+    create_sub_dirs(repo_list)
+    add_phase_stats('config', start_time, len(repo_list))
+
+    update_localmirror(sqliteConnection, repo_list, config)
+
+    start_time = time.time()
+    num_accepted = import_uploads(sqliteConnection, config)
+    add_phase_stats('uploads', start_time, num_accepted)
+
+    start_time = time.time()
+    num_verified = verify_signatures(sqliteConnection, config)
+    add_phase_stats('verify', start_time, num_verified)
+
+    start_time = time.time()
+    remove_old_dbhashes(sqliteConnection)
+    remove_old_dbdownloads(sqliteConnection)
+    num_removed = remove_old_packages(sqliteConnection, config)
+    remove_package_files_not_in_db(sqliteConnection, repo_list)
+    add_phase_stats('retention', start_time, num_removed)
+
+    start_time = time.time()
+    publish_snapshot(sqliteConnection, repo_list, config['snapshot_grace'])
+    add_phase_stats('publish', start_time)
+
+    start_time = time.time()
+    import_xfer_logs(sqliteConnection)
+    export_prometheus_textfile(sqliteConnection, config)
+    add_phase_stats('xfer_stats', start_time)
+
+    write_manifest(sqliteConnection, repo_list)
+
+    peak = get_peak_memory()
+    if peak is not None:
+        debug_print('peak memory: ' + str(peak) + ' kB')
+        if config['memory_limit']  and  peak * 1024 > config['memory_limit']:
+            debug_print('Error: peak memory ' + str(peak) + ' kB exceeds ' +
+                        'MemoryLimit')
+
+    save_run_stats(sqliteConnection, run_start_time)
+    run_stats['phases'].clear()
+    run_stats['mirrors'].clear()
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def poll_lastupdate(sqliteConnection, config, last_seen):
+    """
+    fetch the (tiny)  lastupdate  file of the first  PollMirrors  healthy
+    mirrors of the mirrorlist
+    ( the health of the polls is kept apart from the circuit breaker of the
+      mirrors:  a mirror without  lastupdate  file is skipped for the polls
+      after  MirrorMaxFailures  failures, but not for the downloads )
+
+    :param  sqliteConnection     SQlite3 connection
+    :param  config:              dict with the parsed content of the config-file
+    :param  last_seen:           dict  url -> content  of the previous polls
+                                 (updated)
+    :return:                     True, if it changed on one of the mirrors
+                                 since the previous poll
+    """
+
+    session = get_session()
+
+    poll_health = daemon_state['poll_health']
+    changed = False
+    num_polled = 0
+    for url in config['lastupdate_urls']:
+        if num_polled >= config['poll_mirrors']:
+            break
+        failures, skip_until = poll_health.get(url, (0, 0))
+        if skip_until > time.time()  or  is_mirror_open(sqliteConnection, url):
+            continue
+        num_polled += 1
+
+        start_time = time.time()
+        try:
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            value = response.text.strip()
+        except:
+            add_mirror_stats(url, 0, start_time, error=True)
+            failures += 1
+            if failures >= config['mirror_max_failures']:
+                skip_until = time.time() + config['mirror_backoff']
+                failures = 0
+            poll_health[url] = (failures, skip_until)
+            debug_print("Error: can't fetch " + url)
+            continue
+        add_mirror_stats(url, len(response.content), start_time)
+        poll_health.pop(url, None)
+
+        if url in last_seen  and  last_seen[url] != value:
+            debug_print('upstream changed on ' + mirror_host(url))
+            changed = True
+        last_seen[url] = value
+
+    return changed
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def read_daemon_pid():
+    """
+    read the pid of the running daemon from  PID_FILE
+
+    :return:  pid, or None if no daemon is running
+    """
+
+    try:
+        with open(PID_FILE, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except:
+        return None
+    return pid
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def notify_daemon():
+    """
+    ask the running daemon to sync right away  (SIGUSR1)
+
+    :return:  True, if a daemon was notified
+    """
+
+    pid = read_daemon_pid()
+    if pid is None  or  not hasattr(signal, 'SIGUSR1'):
+        return False
+
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except:
+        return False
+    debug_print('requested a sync from the daemon (pid ' + str(pid) + ')')
+    return True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def handle_signal(signum, frame):
+    """
+    signal handler of the daemon:
+      SIGUSR1:          sync right away
+      SIGTERM, SIGINT:  stop (after the current sync)
+    """
+
+    if signum == getattr(signal, 'SIGUSR1', None):
+        daemon_state['sync_requested'] = True
+    else:
+        daemon_state['stop'] = True
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def run_daemon(sqliteConnection, config_file):
+    """
+    daemon mode ( --daemon ):
+      every  PollInterval  seconds poll the  lastupdate  file of some mirrors
+      and sync only if it changed, on request ( SIGUSR1 ,  --sync ,  -i )
+      or if the last sync is older than  SyncInterval  seconds
+      (for repos whose mirrors don't provide a  lastupdate  file),
+      uploads of the clients are accepted at every poll,
+      changes of the installed packages sent by the clients are applied
+      right away and the newly wanted packages are downloaded
+
+    :param sqliteConnection:  SQLite3 connection object (kept open)
+    :param config_file:       configuration-file
+    :return:
+    """
+
+    if read_daemon_pid() is not None:
+        debug_print('Error: daemon is already running (pid ' +
+                    str(read_daemon_pid()) + ')')
+        sys.exit(1)
+    with open(PID_FILE, 'w') as f:
+        f.write(str(os.getpid()) + '\n')
+
+    for name in ('SIGUSR1', 'SIGTERM', 'SIGINT'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handle_signal)
+
+    debug_print('starting daemon (pid ' + str(os.getpid()) + ')')
+    last_seen = dict()
+    last_sync = 0
+    synced_repos = set()
+    poll_interval = 300
+    try:
+        while not daemon_state['stop']:
+            # (read_config() and co. exit on errors, the daemon goes on
+            #  and tries again after the poll interval)
+            try:
+                num_new = apply_package_diffs(sqliteConnection,
+                                              read_config(list(), config_file)['archs'])
+                config = read_config(get_repo_list(sqliteConnection), config_file)
+                repo_list = config['repo_list']
+                poll_interval = config['poll_interval']
+                set_memory_limit(sqliteConnection, config)
+                changed = poll_lastupdate(sqliteConnection, config, last_seen)
+            except (Exception, SystemExit) as e:
+                debug_print('Error: ' + str(e))
+                changed = None
+
+            if changed is None:
+                pass
+            elif changed  or  daemon_state['sync_requested']  or \
+               time.time() - last_sync >= config['sync_interval']  or \
+               not synced_repos.issuperset(repo_list):
+                daemon_state['sync_requested'] = False
+                last_sync = time.time()
+                synced_repos = set(repo_list)
+                try:
+                    sync_localmirror(sqliteConnection, config_file)
+                except (Exception, SystemExit) as e:
+                    debug_print('Error: sync failed: ' + str(e))
+            else:
+                try:
+                    num_accepted = import_uploads(sqliteConnection, config)
+                    if num_new:
+                        num_accepted += download_wanted_packages(
+                                             sqliteConnection, config)
+                    if num_accepted:
+                        verify_signatures(sqliteConnection, config)
+                        publish_snapshot(sqliteConnection, repo_list,
+                                         config['snapshot_grace'])
+                        write_manifest(sqliteConnection, repo_list)
+                except (Exception, SystemExit) as e:
+                    debug_print('Error: ' + str(e))
+
+            # changes of the installed packages are applied right away
+            # (but not after an error, they would fail again)
+            wait_until = time.time() + poll_interval
+            while time.time() < wait_until  and  not daemon_state['stop']  and \
+                  not daemon_state['sync_requested']  and \
+                  (changed is None  or
+                   not glob.glob(os.path.join('sync', 'pkgdiff_*.txt'))):
+                time.sleep(1)
+    finally:
+        try_unlink(PID_FILE)
+    debug_print('daemon stopped')
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def create_sub_dirs(repo_list):
+    """
+    Create the sub-dirs (if they don't exist)
+    one for each arch/repo and any/repo in the pool, for the package-files
+    plus a snapshots-dir (for the published state, see  publish_snapshot() )
+    plus a tmp-dir (for the <reponame>.db.tar.gz - files)
+    and an upload-dir (for the package-files uploaded by the clients)
+    and a sync-dir (for the changes of the installed packages of the clients)
+
+    :param   repo_list:    list of (arch, repo)
+    """
+
+    def create_sub_dir(sub_dir):
+        if not os.path.exists(sub_dir):
+            try:
+                os.makedirs(sub_dir)
+            except:
+                print("Error:  Can't create sub-dir " + sub_dir)
+                sys.exit(1)
+
+    for arch, repo in repo_list:
+        create_sub_dir(os.path.join(POOL_DIR, arch, repo))
+        create_sub_dir(os.path.join(POOL_DIR, 'any', repo))
+    create_sub_dir(SNAPSHOT_DIR)
+    create_sub_dir('tmp')
+    create_sub_dir('upload')
+    create_sub_dir('sync')
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def main(work_dir, database_file, config_file):
+    """
+    - update the local mirror (once, or as daemon), or
+    - (re-)import the list of installed packages
+
+    :param work_dir:        working directory (with database and config-file)
+    :param database_file:   SQLite3 - dataabase
+    :param config_file:     configuration-file
+    :return:
+    """
+
+    global verbose
+    if "-v" in sys.argv  or  "-vv" in sys.argv:
+        verbose = True
+
+    # JSON-lines run log
+    json_log_path = None
+    if '--log' in sys.argv:
+        pos = sys.argv.index('--log') + 1
+        if pos < len(sys.argv):
+            json_log_path = sys.argv[pos]
+    init_logging(LOG_DEBUG if '-vv' in sys.argv else
+                 LOG_INFO  if verbose              else LOG_ERROR,
+                 json_log_path)
+
+    os.chdir(work_dir)
+    sqliteConnection = open_sqlite_db(database_file)
+
+    if '-i' in sys.argv:
+        import_packages_files(sqliteConnection,
+                              read_config(list(), config_file)['archs'])
+        notify_daemon()
+        sys.exit(0)
+
+    if '--forget-host' in sys.argv:
+        pos = sys.argv.index('--forget-host') + 1
+        if pos >= len(sys.argv):
+            print('Error: --forget-host needs the name of the host')
+            sys.exit(1)
+        forget_host(sqliteConnection, sys.argv[pos])
+        notify_daemon()
+        sys.exit(0)
+
+    if '--sync' in sys.argv:
+        if not notify_daemon():
+            print('Error: no running daemon')
+            sys.exit(1)
+        sys.exit(0)
+
+    if '-d' in sys.argv:
+        print_closure_report(sqliteConnection)
+        sys.exit(0)
+
+    if '--stats' in sys.argv:
+        # optional number of runs following  --stats
+        num_runs = 10
+        pos = sys.argv.index('--stats') + 1
+        if pos < len(sys.argv)  and  sys.argv[pos].isdigit():
+            num_runs = int(sys.argv[pos])
+        print_run_stats(sqliteConnection, num_runs, '--json' in sys.argv)
+        sys.exit(0)
+
+    if '--dry-run' in sys.argv:
+        config = read_config(get_repo_list(sqliteConnection), config_file)
+        remove_old_packages(sqliteConnection, config, dry_run=True)
+        sys.exit(0)
+
+    if '--daemon' in sys.argv:
+        run_daemon(sqliteConnection, config_file)
+    else:
+        sync_localmirror(sqliteConnection, config_file)
 
     sqliteConnection.close()
+    close_logging()
     sys.exit(0)
 # -----------------------------------------------------------------------------------
 
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmark for pacyard
+#   Generates synthetic <repo>.db.tar.gz - files and dummy package files,
+#   serves them from a local HTTP stand-in for the Arch mirrors
+#   and runs the main functions of pacyard against them.
+#   Time, peak memory (tracemalloc) and number of SQL queries of every step
+#   are reported and can be stored as baseline, so that regressions
+#   between versions show up.
+#
+#   Requires Python 3 (tracemalloc) and - like pacyard - wget and curl.
+
+# Examples:
+#   ./pacyard_bench.py                            1k, 5k, 15k and 20k desc entries
+#   ./pacyard_bench.py -n 13000 --latency 50 --bandwidth 2048 --error-rate 0.05
+#   ./pacyard_bench.py --save v1.1                store results as baseline 'v1.1'
+#   ./pacyard_bench.py --baseline v1.1            compare with baseline 'v1.1'
+#   ./pacyard_bench.py -n 15000 --max-memory 32M  fail if a step needs more memory
+#   ./pacyard_bench.py -n 1000 --max-memory 16M   quick run (without the 15k run,
+#                                                 the default memory check fails)
+
+
+from __future__ import print_function
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import tarfile
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from email.utils import formatdate
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pacyard
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'pacyard_bench_baseline.json')
+REPOS = ('core', 'extra')
+ARCH = 'x86_64'
+
+# stated peak memory (tracemalloc) of every step of a sync of a repo of the
+# size of  extra  (15k desc entries), checked by default
+# (fails if the 15k run is missing, a smaller run would prove nothing)
+# ( get_repo_content()  isn't part of the sync, it reads the whole repo )
+SYNC_MEMORY_LIMIT = 16 * 1024 * 1024
+SYNC_MEMORY_ENTRIES = 15000
+SYNC_MEMORY_EXCLUDED = ('get_repo_content',)
+
+
+# -----------------------------------------------------------------------------------
+def gen_repo(repo, num_entries, rnd):
+    """
+    generate the synthetic content of a repo
+
+    :param  repo:         name of the repository
+    :param  num_entries:  number of packages (desc entries)
+    :param  rnd:          random.Random instance
+    :return:              list of dicts (name, version, filename, builddate,
+                                         csize, depends, provides, replaces)
+    """
+
+    packages = list()
+    for i in range(num_entries):
+        name = '%s-pkg%05d' % (repo, i)
+        version = '%d.%d.%d-%d' % (rnd.randint(0, 9), rnd.randint(0, 30),
+                                   rnd.randint(0, 99), rnd.randint(1, 3))
+        depends = list()
+        for j in rnd.sample(range(i), min(i, rnd.randint(0, 8))):
+            dep = packages[j]['name']
+            if rnd.random() < 0.2:
+                dep += '>=' + packages[j]['version'].split('-')[0]
+            depends.append(dep)
+        provides = list()
+        if rnd.random() < 0.05:
+            provides.append('lib%s.so=%d-64' % (name, rnd.randint(1, 9)))
+        replaces = list()
+        if rnd.random() < 0.01:
+            replaces.append(name + '-old')
+        packages.append({ 'name': name,
+                          'version': version,
+                          'filename': name + '-' + version + '-' + ARCH +
+                                      '.pkg.tar.zst',
+                          'builddate': 1600000000 + rnd.randint(0, 10**8),
+                          'csize': rnd.randint(10**4, 10**6),
+                          'depends': depends,
+                          'provides': provides,
+                          'replaces': replaces })
+    return packages
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def gen_desc(pkg, rnd):
+    """
+    generate a (realistically sized) desc - file of a repo DB
+
+    :param  pkg:   dict with the package
+    :param  rnd:   random.Random instance
+    :return:       content of the desc - file (bytes)
+    """
+
+    fields = [ ('FILENAME', [pkg['filename']]),
+               ('NAME', [pkg['name']]),
+               ('BASE', [pkg['name']]),
+               ('VERSION', [pkg['version']]),
+               ('DESC', ['Synthetic package ' + pkg['name'] + ' for benchmarks']),
+               ('CSIZE', [str(pkg['csize'])]),
+               ('ISIZE', [str(pkg['csize'] * 3)]),
+               ('MD5SUM', ['%032x' % rnd.getrandbits(128)]),
+               ('SHA256SUM', ['%064x' % rnd.getrandbits(256)]),
+               ('PGPSIG', ['%0660x' % rnd.getrandbits(2640)]),
+               ('URL', ['https://example.org/' + pkg['name']]),
+               ('LICENSE', ['GPL']),
+               ('ARCH', [ARCH]),
+               ('BUILDDATE', [str(pkg['builddate'])]),
+               ('PACKAGER', ['Bench Packager <bench@example.org>']),
+               ('DEPENDS', pkg['depends']),
+               ('PROVIDES', pkg['provides']),
+               ('REPLACES', pkg['replaces']) ]
+
+    lines = list()
+    for key, values in fields:
+        if values:
+            lines += ['%' + key + '%'] + values + ['']
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def gen_db_file(file_path, packages, rnd):
+    """
+    write the synthetic <repo>.db.tar.gz - file
+
+    :param  file_path:  path of the DB-file
+    :param  packages:   list of dicts with the packages
+    :param  rnd:        random.Random instance
+    """
+
+    with tarfile.open(file_path, 'w:gz') as tar:
+        for pkg in packages:
+            data = gen_desc(pkg, rnd)
+            member = tarfile.TarInfo(pkg['name'] + '-' + pkg['version'] + '/desc')
+            member.size = len(data)
+            member.mtime = pkg['builddate']
+            tar.addfile(member, io.BytesIO(data))
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+class MirrorHandler(BaseHTTPRequestHandler):
+    """
+    HTTP stand-in for an Arch mirror:
+      serves the DB-files from the document root and dummy package files
+      (zero bytes of the size given in  server.file_sizes ),
+      with configurable latency, bandwidth and error injection
+      (HTTP/1.1 like the real mirrors, so that connections are kept alive)
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_file(self, with_body):
+        server = self.server
+        server.count_request()
+
+        time.sleep(server.latency)
+        if server.rnd.random() < server.error_rate:
+            self.send_error(500)
+            return
+
+        path = self.path.lstrip('/')
+        file_name = os.path.basename(path)
+        local_path = os.path.join(server.doc_root, path)
+        if os.path.isfile(local_path):
+            with open(local_path, 'rb') as f:
+                data = f.read()
+        elif file_name in server.file_sizes:
+            data = b'\0' * server.file_sizes[file_name]
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        if not with_body:
+            return
+
+        chunk_size = 16384
+        for pos in range(0, len(data), chunk_size):
+            chunk = data[pos:pos + chunk_size]
+            self.wfile.write(chunk)
+            if server.bandwidth:
+                time.sleep(len(chunk) / server.bandwidth)
+
+    def do_HEAD(self):
+        self.send_file(False)
+
+    def do_GET(self):
+        self.send_file(True)
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+class MirrorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, doc_root, latency, bandwidth, error_rate, seed):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), MirrorHandler)
+        self.doc_root = doc_root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.file_sizes = dict()
+        self.last_modified = formatdate(usegmt=True)
+        self.num_requests = 0
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.num_requests += 1
+
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def measure(results, step, sqliteConnection, server, func, *args):
+    """
+    run  func(*args)  and record time, peak memory, number of SQL queries
+    and number of HTTP requests in  results[step]
+
+    :return:  return value of func
+    """
+
+    queries = [0]
+
+    def count_query(statement):
+        queries[0] += 1
+
+    sqliteConnection.set_trace_callback(count_query)
+    num_requests = server.num_requests
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        ret = func(*args)
+    finally:
+        seconds = time.perf_counter() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        sqliteConnection.set_trace_callback(None)
+
+    results[step] = { 'seconds': round(seconds, 4),
+                      'peak_kb': peak // 1024,
+                      'queries': queries[0],
+                      'requests': server.num_requests - num_requests }
+    print('  %-32s %9.3fs %10d kB %8d queries %6d requests' %
+          (step, seconds, peak // 1024, queries[0],
+           server.num_requests - num_requests))
+    return ret
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def run_benchmark(num_entries, args):
+    """
+    generate the synthetic repos, start the mirror stand-in and
+    run the pacyard functions against it
+
+    :param  num_entries:  number of desc entries per repo
+    :param  args:         parsed command line arguments
+    :return:              dict  step -> measured values
+    """
+
+    print('%d desc entries per repo' % num_entries)
+    rnd = random.Random(args.seed)
+    results = dict()
+    old_cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='pacyard_bench_')
+    doc_root = os.path.join(work_dir, 'www')
+    server = MirrorServer(doc_root, args.latency / 1000.0,
+                          args.bandwidth * 1024, args.error_rate, args.seed)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        os.chdir(work_dir)
+        with open('pacyard.conf', 'w') as f:
+            f.write('[options]\nNumVersionsToKeep = 3\nArch = %s\n\n' % ARCH)
+            f.write('[mirrorlist]\nServer = %s/$repo/os/$arch\n\n' % server.url())
+            for repo in REPOS:
+                f.write('[%s]\nInclude = mirrorlist\n\n' % repo)
+
+        for repo in REPOS:
+            packages = gen_repo(repo, num_entries, rnd)
+            repo_dir = os.path.join(doc_root, repo, 'os', ARCH)
+            os.makedirs(repo_dir)
+            gen_db_file(os.path.join(repo_dir, repo + '.db.tar.gz'), packages, rnd)
+            installed = [pkg for pkg in packages
+                         if rnd.random() < args.installed]
+            with open('packages_%s_benchhost.txt' % repo, 'w') as f:
+                f.write('\n'.join([pkg['name'] for pkg in installed]) + '\n')
+            for pkg in packages:
+                server.file_sizes[pkg['filename']] = args.pkg_size
+                server.file_sizes[pkg['filename'] + '.sig'] = 566
+
+        sqliteConnection = pacyard.open_sqlite_db('pacyard.db')
+
+        measure(results, 'import_packages_files', sqliteConnection, server,
+                pacyard.import_packages_files, sqliteConnection, [ARCH])
+
+        config = pacyard.read_config(pacyard.get_repo_list(sqliteConnection),
+                                     'pacyard.conf')
+        repo_list = config['repo_list']
+        pacyard.create_sub_dirs(repo_list)
+
+        db_file = os.path.join('tmp', 'bench.db.tar.gz')
+        shutil.copy(os.path.join(doc_root, REPOS[-1], 'os', ARCH,
+                                 REPOS[-1] + '.db.tar.gz'), db_file)
+        measure(results, 'get_repo_content', sqliteConnection, server,
+                pacyard.get_repo_content, db_file)
+
+        measure(results, 'update_localmirror', sqliteConnection, server,
+                pacyard.update_localmirror, sqliteConnection, repo_list, config)
+        measure(results, 'update_localmirror (unchanged)', sqliteConnection,
+                server, pacyard.update_localmirror,
+                sqliteConnection, repo_list, config)
+
+        measure(results, 'cleanup_table_localmirror', sqliteConnection, server,
+                pacyard.cleanup_table_localmirror, sqliteConnection)
+        measure(results, 'remove_old_packages', sqliteConnection, server,
+                pacyard.remove_old_packages, sqliteConnection, config)
+        measure(results, 'remove_package_files_not_in_db', sqliteConnection,
+                server, pacyard.remove_package_files_not_in_db,
+                sqliteConnection, repo_list)
+        measure(results, 'publish_snapshot', sqliteConnection, server,
+                pacyard.publish_snapshot, sqliteConnection, repo_list)
+
+        sqliteConnection.close()
+    finally:
+        os.chdir(old_cwd)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    print the changes compared to the baseline
+
+    :param  results:    dict  num_entries -> step -> measured values
+    :param  baseline:   same structure, stored before
+    :param  tolerance:  allowed relative increase (0.2 = 20 %)
+    :return:            number of regressions
+    """
+
+    num_regressions = 0
+    for num_entries in sorted(results.keys(), key=int):
+        if num_entries not in baseline:
+            continue
+        print('%s desc entries per repo, compared to baseline:' % num_entries)
+        for step, values in sorted(results[num_entries].items()):
+            base = baseline[num_entries].get(step)
+            if base is None:
+                continue
+            line = '  %-32s' % step
+            for key in ('seconds', 'peak_kb', 'queries'):
+                if base[key]:
+                    change = float(values[key] - base[key]) / base[key]
+                else:
+                    change = 0.0 if not values[key] else 1.0
+                line += ' %8s %+7.1f%%' % (key, change * 100)
+                # timings below 10 ms are too noisy to judge
+                if change > tolerance  and \
+                   (key != 'seconds'  or  values[key] >= 0.01):
+                    line += ' REGRESSION'
+                    num_regressions += 1
+            print(line)
+    return num_regressions
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def check_memory_limit(results, limit, entries=None, excluded=()):
+    """
+    print the steps whose peak memory exceeds the limit
+
+    :param  results:    dict  num_entries -> step -> measured values
+    :param  limit:      max. peak memory [bytes]
+    :param  entries:    check only the run with this number of desc entries
+                        (None: all runs)
+    :param  excluded:   steps which aren't checked
+    :return:            number of steps above the limit
+    """
+
+    num_exceeded = 0
+    for num_entries in sorted(results.keys(), key=int):
+        if entries is not None  and  int(num_entries) != entries:
+            continue
+        for step, values in sorted(results[num_entries].items()):
+            if step in excluded:
+                continue
+            if values['peak_kb'] * 1024 > limit:
+                print('%s desc entries per repo: %-32s %10d kB  MEMORY LIMIT EXCEEDED' %
+                      (num_entries, step, values['peak_kb']))
+                num_exceeded += 1
+    return num_exceeded
+# -----------------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='benchmark for pacyard')
+    parser.add_argument('-n', '--entries', type=int, action='append',
+                        help='desc entries per repo (default: 1000, 5000, 15000, 20000)')
+    parser.add_argument('--installed', type=float, default=0.05,
+                        help='share of installed packages (default: 0.05)')
+    parser.add_argument('--pkg-size', type=int, default=65536,
+                        help='size of the dummy package files [bytes]')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency of the mirror stand-in [ms]')
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help='bandwidth of the mirror stand-in [kB/s], 0: unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests failing with HTTP 500')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', metavar='LABEL',
+                        help='store the results as baseline LABEL')
+    parser.add_argument('--baseline', metavar='LABEL',
+                        help='compare with baseline LABEL (default: last stored)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative increase (default: 0.2)')
+    parser.add_argument('--max-memory', metavar='SIZE',
+                        help='max. peak memory of every step (i.e. 32M), '
+                             'default: %d MB for the sync steps of the run with '
+                             '%d entries' % (SYNC_MEMORY_LIMIT // 1048576,
+                                             SYNC_MEMORY_ENTRIES))
+    args = parser.parse_args()
+
+    pacyard.verbose = False
+
+    results = dict()
+    for num_entries in args.entries or [1000, 5000, SYNC_MEMORY_ENTRIES, 20000]:
+        results[str(num_entries)] = run_benchmark(num_entries, args)
+
+    baselines = { 'order': [], 'results': {} }
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            baselines = json.load(f)
+
+    label = args.baseline or (baselines['order'][-1] if baselines['order'] else None)
+    num_regressions = 0
+    if label in baselines['results']:
+        print('')
+        print('baseline: ' + label)
+        num_regressions = compare_with_baseline(results,
+                                                baselines['results'][label],
+                                                args.tolerance)
+    elif args.baseline:
+        print('Error: unknown baseline ' + args.baseline)
+
+    if args.max_memory:
+        num_regressions += check_memory_limit(results,
+                                              pacyard.parse_size(args.max_memory))
+    elif str(SYNC_MEMORY_ENTRIES) not in results:
+        print('Error: memory limit not checked, the run with %d entries is '
+              'missing (add  -n %d  or use  --max-memory )' %
+              (SYNC_MEMORY_ENTRIES, SYNC_MEMORY_ENTRIES))
+        num_regressions += 1
+    else:
+        num_regressions += check_memory_limit(results, SYNC_MEMORY_LIMIT,
+                                              SYNC_MEMORY_ENTRIES,
+                                              SYNC_MEMORY_EXCLUDED)
+
+    if args.save:
+        if args.save in baselines['order']:
+            baselines['order'].remove(args.save)
+        baselines['order'].append(args.save)
+        baselines['results'][args.save] = results
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print('stored baseline ' + args.save)
+
+    sys.exit(1 if num_regressions else 0)
+# -----------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/bash
+
+# Sends the changes of the installed packages (per repo) to pacyard
+# (called by the pacman hook  pacyard.hook  after every transaction)
+# The first call sends the complete list.
+
+
+# define the list of repositories which are activated in /etc/pacman.conf
+REPO_LIST=(core extra community multilib herecura)
+
+# sync-dir of the local mirror (a share of the sub-dir  sync  of pacyard's
+# working directory)
+SYNC_DIR=/mnt/pacyard/sync
+
+# lists of the installed packages as last sent to pacyard
+STATE_DIR=/var/lib/pacyard
+
+
+mkdir -p $STATE_DIR
+DIFF_FILE=$STATE_DIR/pkgdiff.txt
+: > $DIFF_FILE
+
+for repo in ${REPO_LIST[@]}; do
+  touch $STATE_DIR/packages_${repo}.txt
+  paclist $repo | cut -d ' ' -f 1 | sort > $STATE_DIR/packages_${repo}.new
+  comm -13 $STATE_DIR/packages_${repo}.txt $STATE_DIR/packages_${repo}.new | sed "s/^/+ $repo /" >> $DIFF_FILE
+  comm -23 $STATE_DIR/packages_${repo}.txt $STATE_DIR/packages_${repo}.new | sed "s/^/- $repo /" >> $DIFF_FILE
+done
+
+if [ ! -s $DIFF_FILE ]; then
+  exit 0
+fi
+
+# write as .part file first, so that pacyard doesn't see incomplete files;
+# on failure the changes are sent again after the next transaction
+SYNC_FILE=$SYNC_DIR/pkgdiff_$(hostname)_$(uname -m)_$(date +%s%N).txt
+cp $DIFF_FILE $SYNC_FILE.part  &&  mv $SYNC_FILE.part $SYNC_FILE  || exit 0
+
+for repo in ${REPO_LIST[@]}; do
+  mv $STATE_DIR/packages_${repo}.new $STATE_DIR/packages_${repo}.txt
+done